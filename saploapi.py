@@ -1,19 +1,970 @@
+import codecs
+import collections
+import errno
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import os
+import Queue
+import re
+import select
 import urllib
 import urllib2
+import httplib
+import random
+import socket
+import sqlite3
+import ssl
+import StringIO
+import threading
+import time
+import traceback
+import urlparse
+import zlib
+
+#ujson is used for encoding and decoding requests when it is installed
+try:
+        import ujson
+except ImportError:
+        ujson = None
+
+class SaploJSONCodec:
+        """
+        Encodes requests and decodes responses for SaploJSONClient.
+
+        Uses ujson when it is installed, which is several times faster than the standard json module
+        on large article bodies and result lists. Any object with the same dumps and loads methods
+        can be given to a client as its codec.
+        """
+        def __init__(self, library=None):
+                """
+                @type Module
+                @param library - A module with dumps and loads functions, ujson or json by default
+                """
+                self.library = library if library is not None else (ujson or json)
+
+        def dumps(self, value):
+                return self.library.dumps(value)
+
+        def loads(self, data):
+                return self.library.loads(data)
+
+
+#Compact records for the items of streamed results, with the same field names as the response dictionaries
+Tag               = collections.namedtuple('Tag', 'tagId tagWord tagTypeId')
+SimilarArticle    = collections.namedtuple('SimilarArticle', 'matchId resultCorpusId resultArticleId resultValue')
+ContextSimilarity = collections.namedtuple('ContextSimilarity', 'contextId SemanticResultValue')
+
+
+class SaploStreamDecoder:
+        """
+        Incrementally decodes a JSON-RPC response object that is fed to it in chunks.
+
+        The items of a result list are returned as soon as each of them is complete, without buffering
+        the whole response. Everything else in the response (id, error, a result that is not a list) is
+        collected in response.
+
+        Example of usage:
+                decoder = SaploStreamDecoder()
+                for chunk in chunks:
+                        for item in decoder.feed(chunk):
+                                print item['tagWord']
+                decoder.close()
+                print decoder.response
+        """
+        whitespace = re.compile(r'\s*')
+        delimiters = u' \t\r\n,:]}'
+        incomplete = object()
+
+        def __init__(self, streamedkey='result'):
+                """
+                @type String
+                @param streamedkey - The response member whose list items are streamed
+                """
+                self.streamedkey = streamedkey
+                self.response    = {}
+                self.count       = 0
+                self.__text      = codecs.getincrementaldecoder('utf-8')()
+                self.__json      = json.JSONDecoder()
+                self.__buffer    = u''
+                self.__pos       = 0
+                self.__state     = 'start'
+                self.__key       = None
+
+        def feed(self, data):
+                """
+                @type String
+                @param data - The next chunk of the UTF-8 encoded response
+                @rtype Array
+                @return The result items completed by this chunk
+                """
+                self.__buffer = self.__buffer[self.__pos:] + self.__text.decode(data)
+                self.__pos    = 0
+                items = []
+                while self.__step(items):
+                        pass
+                return items
+
+        def close(self):
+                """
+                Checks that the complete response has been fed.
+                """
+                if self.__state != 'end':
+                        raise SaploError("An error has occured: 'Incomplete JSON response' With code = ()")
+
+        def __step(self, items):
+                '''
+                Consumes one token or value from the buffer, returning False when more data is needed
+                '''
+                self.__pos = self.whitespace.match(self.__buffer, self.__pos).end()
+                if self.__pos >= len(self.__buffer) or self.__state == 'end':
+                        return False
+                char = self.__buffer[self.__pos]
+
+                if self.__state == 'start':
+                        self.__expect(char, '{')
+                        self.__state = 'key'
+                elif self.__state == 'key':
+                        if char in ',}':
+                                self.__pos  += 1
+                                self.__state = 'end' if char == '}' else 'key'
+                                return True
+                        key = self.__value()
+                        if key is self.incomplete:
+                                return False
+                        self.__key   = key
+                        self.__state = 'colon'
+                elif self.__state == 'colon':
+                        self.__expect(char, ':')
+                        self.__state = 'value'
+                elif self.__state == 'value':
+                        if char == '[' and self.__key == self.streamedkey:
+                                self.response[self.__key] = []
+                                self.__pos  += 1
+                                self.__state = 'items'
+                                return True
+                        value = self.__value()
+                        if value is self.incomplete:
+                                return False
+                        self.response[self.__key] = value
+                        self.__state = 'key'
+                elif self.__state == 'items':
+                        if char in ',]':
+                                self.__pos  += 1
+                                self.__state = 'key' if char == ']' else 'items'
+                                return True
+                        item = self.__value()
+                        if item is self.incomplete:
+                                return False
+                        items.append(item)
+                        self.count += 1
+                return True
+
+        def __value(self):
+                '''
+                Decodes the value at the current position, or returns incomplete if it is not complete yet
+                '''
+                try:
+                        value, end = self.__json.raw_decode(self.__buffer, self.__pos)
+                except ValueError:
+                        return self.incomplete
+                #A value is only complete once the character after it has arrived, a number could otherwise continue in the next chunk
+                if end >= len(self.__buffer) or self.__buffer[end] not in self.delimiters:
+                        return self.incomplete
+                self.__pos = end
+                return value
+
+        def __expect(self, char, expected):
+                if char != expected:
+                        raise SaploError("An error has occured: 'Malformed JSON response' With code = ()")
+                self.__pos += 1
+
 
 class SaploError(Exception):
         """
         Is thrown when an request to the Saplo API for some reason fails
 
         All requests to the SaploJSOnClient should catch this exception, and handle it
+        The error code returned by the API, if any, is kept in code
         """
-        def __init__(self, value):
+        def __init__(self, value, code=None):
                 self.value = value
+                self.code  = code
         def __str__(self):
                 return repr(self.value)
 
 
+class SaploConnectionPool:
+        """
+        Pool of persistent HTTP/1.1 keep-alive connections.
+
+        Connections are kept per (scheme, host, port) and handed out to one request at a time,
+        so a pool can safely be shared between several SaploJSONClients and threads. An idle connection
+        is only reused if the server has not closed it meanwhile.
+
+        Example of usage:
+                pool   = SaploConnectionPool(maxsize=8, idletimeout=2)
+                client = SaploJSONClient(apikey, secretkey, pool=pool)
+                ...
+                print pool.stats()
+        """
+        def __init__(self, maxsize=4, idletimeout=4, maxrequests=1000, timeout=None):
+                """
+                @type Number
+                @param maxsize     - The maximum number of idle connections kept open per host
+                @type Number
+                @param idletimeout - Seconds an idle connection may be kept before it is discarded.
+                        Keep it below the server's keep-alive timeout, which is only a few seconds on most servers.
+                @type Number
+                @param maxrequests - How many requests a single connection may serve before it is closed
+                @type Number
+                @param timeout     - Socket timeout in seconds for new connections (None uses the socket default)
+                """
+                self.maxsize     = maxsize
+                self.idletimeout = idletimeout
+                self.maxrequests = maxrequests
+                self.timeout     = timeout
+                self.__idle      = {}
+                self.__lock      = threading.Lock()
+                self.__stats     = dict(requests = 0, created = 0, reused = 0, discarded = 0)
+
+        def urlopen(self, url, body, headers=None, timeout=None):
+                """
+                Posts body to url over a pooled connection.
+
+                @type String
+                @param url - The full url to post to
+                @type String
+                @param body - The request body
+                @type Dictionary
+                @param headers - Extra request headers
+                @type Float
+                @param timeout - Socket timeout in seconds for this request, if it is shorter than the pool's timeout
+                @rtype SaploPooledResponse
+                @return A file-like response, the connection is handed back to the pool once it has been read
+                """
+                parts = urlparse.urlsplit(url)
+                key   = (parts.scheme, parts.hostname, parts.port)
+                path  = parts.path or '/'
+                if parts.query:
+                        path = path + '?' + parts.query
+
+                allheaders = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+                allheaders.update(headers or {})
+                if timeout is None or (self.timeout is not None and self.timeout < timeout):
+                        timeout = self.timeout
+
+                conn, reused = self.__acquire(key)
+                try:
+                        start, connected = self.__send(conn, path, body, allheaders, timeout)
+                except (httplib.HTTPException, socket.error):
+                        conn.close()
+                        self.__count('discarded')
+                        if not reused:
+                                raise
+                        #The server may have closed an idle connection on us before the request was written,
+                        #so it has not seen the request, try once more on a fresh one
+                        conn, reused = self.__connect(key), False
+                        start, connected = self.__send(conn, path, body, allheaders, timeout)
+                try:
+                        response = conn.getresponse()
+                except (httplib.HTTPException, socket.error):
+                        #The server may have processed the request, whether to send it again is up to the caller
+                        conn.close()
+                        self.__count('discarded')
+                        raise
+                connecttime, waittime = connected - start, time.time() - connected
+
+                conn.saplorequests += 1
+                self.__count('requests')
+                pooled = SaploPooledResponse(self, key, conn, response, connecttime, waittime)
+                if response.status >= 400:
+                        #Read the error body so the connection goes back to the pool
+                        fp = StringIO.StringIO(pooled.read())
+                        raise urllib2.HTTPError(url, response.status, response.reason, response.msg, fp)
+                return pooled
+
+        def release(self, key, conn, reusable=True):
+                """
+                Hands a connection back to the pool. Called by SaploPooledResponse when the response is consumed.
+                """
+                if not reusable or conn.saplorequests >= self.maxrequests:
+                        conn.close()
+                        self.__count('discarded')
+                        return
+                with self.__lock:
+                        idle = self.__idle.setdefault(key, [])
+                        if len(idle) < self.maxsize:
+                                idle.append((time.time(), conn))
+                                return
+                conn.close()
+                self.__count('discarded')
+
+        def stats(self):
+                """
+                Gives counters describing how the pool has been used.
+
+                @rtype Dictionary
+                @return
+                        requests   Number   Requests sent through the pool
+                        created    Number   New connections opened
+                        reused     Number   Requests that reused a kept-alive connection
+                        discarded  Number   Connections closed because they were stale, broken or worn out
+                        idle       Number   Connections currently idle in the pool
+                """
+                with self.__lock:
+                        stats = dict(self.__stats)
+                        stats['idle'] = sum(len(idle) for idle in self.__idle.values())
+                return stats
+
+        def close(self):
+                """
+                Closes all idle connections.
+                """
+                with self.__lock:
+                        idle, self.__idle = self.__idle, {}
+                for conns in idle.values():
+                        for stamp, conn in conns:
+                                conn.close()
+
+        def __acquire(self, key):
+                now = time.time()
+                stale = []
+                found = None
+                with self.__lock:
+                        idle = self.__idle.get(key, [])
+                        while idle:
+                                stamp, conn = idle.pop()
+                                if now - stamp > self.idletimeout or not self.__alive(conn):
+                                        stale.append(conn)
+                                else:
+                                        found = conn
+                                        break
+                for conn in stale:
+                        conn.close()
+                        self.__count('discarded')
+                if found is not None:
+                        self.__count('reused')
+                        return found, True
+                return self.__connect(key), False
+
+        def __alive(self, conn):
+                '''
+                Tells whether an idle connection is still open. The server sends nothing on an idle
+                connection, so a readable socket means that it has been closed from the other end.
+                '''
+                if conn.sock is None:
+                        return False
+                try:
+                        if hasattr(select, 'poll'):
+                                poller = select.poll()
+                                poller.register(conn.sock, select.POLLIN | select.POLLPRI)
+                                return not poller.poll(0)
+                        return not select.select([conn.sock], [], [], 0)[0]
+                except (select.error, socket.error, ValueError):
+                        return False
+
+        def __connect(self, key):
+                scheme, host, port = key
+                connclass = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+                if self.timeout is None:
+                        conn = connclass(host, port)
+                else:
+                        conn = connclass(host, port, timeout=self.timeout)
+                conn.saplorequests = 0
+                self.__count('created')
+                return conn
+
+        def __send(self, conn, path, body, headers, timeout):
+                '''
+                Writes the request and returns the times at which connecting started and finished.
+                The timeout applies to connecting, writing the request and reading the response.
+                '''
+                start = time.time()
+                timeout = timeout if timeout is not None else socket.getdefaulttimeout()
+                conn.timeout = timeout
+                if conn.sock is None:
+                        conn.connect()
+                else:
+                        conn.sock.settimeout(timeout)
+                connected = time.time()
+                conn.request('POST', path, body, headers)
+                return start, connected
+
+        def __count(self, name):
+                with self.__lock:
+                        self.__stats[name] += 1
+
+
+class SaploPooledResponse:
+        """
+        File-like wrapper around a pooled httplib response.
+        Reading the body to the end (or closing it) hands the connection back to its pool.
+
+        connecttime is the time spent opening the connection (0 for a reused one), waittime the time
+        spent sending the request and waiting for and reading the response, and received the body bytes read so far.
+        """
+        def __init__(self, pool, key, conn, response, connecttime=0.0, waittime=0.0):
+                self.pool        = pool
+                self.key         = key
+                self.conn        = conn
+                self.response    = response
+                self.status      = response.status
+                self.headers     = response.msg
+                self.connecttime = connecttime
+                self.waittime    = waittime
+                self.received    = 0
+
+        def read(self, amt=None):
+                start = time.time()
+                try:
+                        data = self.response.read(amt) if amt is not None else self.response.read()
+                except (httplib.HTTPException, socket.error):
+                        self.__finish(False)
+                        raise
+                self.waittime += time.time() - start
+                self.received += len(data)
+                if amt is None or not data:
+                        self.__finish(not self.response.will_close)
+                return data
+
+        def info(self):
+                return self.headers
+
+        def close(self):
+                #A response that has not been read to the end leaves the connection in an unknown state
+                self.__finish(self.response.isclosed() and not self.response.will_close)
+
+        def __finish(self, reusable):
+                if self.conn is None:
+                        return
+                conn, self.conn = self.conn, None
+                self.pool.release(self.key, conn, reusable)
+
+
+class SaploBatch:
+        """
+        Collects several JSON-RPC calls and sends them to the Saplo API in one HTTP request.
+
+        Every call gets its own id and the responses are matched back by it. A call that fails
+        does not abort the batch, its place in the results holds the SaploError instead.
+
+        Example of usage:
+                with client.batch() as batch:
+                        batch.addArticle(corpusId, "Headline", "", "Body text", "", "", "", "en")
+                        batch.addArticle(corpusId, "Other headline", "", "Other text", "", "", "", "en")
+                for result in batch.results:
+                        if isinstance(result, SaploError):
+                                print result
+                        else:
+                                print result['result']['articleId']
+        """
+        def __init__(self, execute):
+                """
+                @type Function
+                @param execute - Sends a list of (method, params) tuples and returns the results in the same order
+                """
+                self.calls     = []
+                self.results   = None
+                self.__execute = execute
+
+        def call(self, meth, params):
+                """
+                Queues a call to any JSON-RPC method.
+
+                @type String
+                @param meth - The JSON-RPC method name, i.e. 'corpus.addArticle'
+                @type Array
+                @param params - The method params
+                @rtype Number
+                @return The position of the call's result in results
+                """
+                self.calls.append((meth, params))
+                return len(self.calls) - 1
+
+        def addArticle(self, corpusId, headline, lead, body, publishStart, publishUrl, authors, lang):
+                """
+                Queues an addArticle call. Takes the same params as SaploJSONClient.addArticle.
+                """
+                params = (corpusId, headline, lead, body, publishStart, publishUrl, authors, lang)
+                return self.call('corpus.addArticle', params)
+
+        def execute(self):
+                """
+                Sends all queued calls.
+
+                @rtype Array
+                @return One response dictionary or SaploError per queued call, in the order they were queued
+                """
+                calls, self.calls = self.calls, []
+                self.results = self.__execute(calls) if calls else []
+                return self.results
+
+        def __len__(self):
+                return len(self.calls)
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, exctype, value, traceback):
+                if exctype is None:
+                        self.execute()
+                return False
+
+
+class SaploFuture:
+        """
+        The pending result of a call that runs in the background.
+
+        Example of usage:
+                future = asyncclient.getEntityTags(corpusId, articleId, 0)
+                ...
+                try:
+                        tags = future.result()['result']
+                except SaploError, err:
+                        print err.__str__()
+        """
+        def __init__(self):
+                self.__event     = threading.Event()
+                self.__lock      = threading.Lock()
+                self.__result    = None
+                self.__error     = None
+                self.__callbacks = []
+
+        def done(self):
+                """
+                @rtype Bool
+                @return Whether the call has finished, successfully or not
+                """
+                return self.__event.is_set()
+
+        def result(self, timeout=None):
+                """
+                Waits for the call to finish and returns its result, raising the error if the call failed.
+
+                @type Number
+                @param timeout - Maximum number of seconds to wait, None waits forever
+                """
+                self.__wait(timeout)
+                if self.__error is not None:
+                        raise self.__error
+                return self.__result
+
+        def exception(self, timeout=None):
+                """
+                Waits for the call to finish and returns the error it failed with, or None.
+
+                @type Number
+                @param timeout - Maximum number of seconds to wait, None waits forever
+                """
+                self.__wait(timeout)
+                return self.__error
+
+        def addDoneCallback(self, fn):
+                """
+                Calls fn(future) once the call has finished, right away if it already has.
+                An exception raised by fn is printed to stderr and does not affect the future or other callbacks.
+                """
+                with self.__lock:
+                        if not self.__event.is_set():
+                                self.__callbacks.append(fn)
+                                return
+                self.__callback(fn)
+
+        def setResult(self, result):
+                self.__finish(result, None)
+
+        def setError(self, error):
+                self.__finish(None, error)
+
+        def __finish(self, result, error):
+                with self.__lock:
+                        if self.__event.is_set():
+                                return
+                        self.__result = result
+                        self.__error  = error
+                        self.__event.set()
+                        callbacks, self.__callbacks = self.__callbacks, []
+                for fn in callbacks:
+                        self.__callback(fn)
+
+        def __callback(self, fn):
+                '''
+                Runs a done callback. It runs on the thread that finished the call, i.e. an executor
+                worker, which must not be killed by an error in the caller's code.
+                '''
+                try:
+                        fn(self)
+                except Exception:
+                        traceback.print_exc()
+
+        def __wait(self, timeout):
+                if not self.__event.wait(timeout):
+                        raise SaploError("An error has occured: 'Timed out waiting for result' With code = ()")
+
+
+class SaploRateLimiter:
+        """
+        Token bucket limiting how many requests per second are started.
+        Safe to share between threads, every acquire() takes one token and blocks until one is available.
+        """
+        def __init__(self, rate, burst=None):
+                """
+                @type Float
+                @param rate - Requests per second
+                @type Number
+                @param burst - How many requests may be started back to back after an idle period (defaults to rate)
+                """
+                self.rate     = float(rate)
+                self.burst    = max(1, burst if burst is not None else int(rate))
+                self.__tokens = float(self.burst)
+                self.__last   = time.time()
+                self.__lock   = threading.Lock()
+
+        def acquire(self):
+                while True:
+                        with self.__lock:
+                                now = time.time()
+                                self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+                                self.__last   = now
+                                if self.__tokens >= 1:
+                                        self.__tokens -= 1
+                                        return
+                                delay = (1 - self.__tokens) / self.rate
+                        time.sleep(delay)
+
+
+class SaploExecutor:
+        """
+        Runs calls on a fixed number of worker threads, so at most that many are in flight at once.
+        An executor may be shared between threads, optionally with a requests per second limit for all of them.
+        """
+        def __init__(self, workers=8, rate=None, burst=None):
+                """
+                @type Number
+                @param workers - Number of worker threads, i.e. the maximum number of concurrent calls
+                @type Float
+                @param rate - Maximum number of calls started per second, None for no limit
+                @type Number
+                @param burst - Token bucket size for the rate limit (defaults to rate)
+                """
+                self.workers  = workers
+                self.limiter  = SaploRateLimiter(rate, burst) if rate else None
+                self.__queue  = Queue.Queue()
+                self.__lock   = threading.Lock()
+                self.__threads = []
+
+        def submit(self, fn, *args, **kwargs):
+                """
+                Schedules fn(*args, **kwargs) to run on a worker thread.
+
+                @rtype SaploFuture
+                @return A future for the value returned by fn
+                """
+                future = SaploFuture()
+                self.__start()
+                self.__queue.put((future, fn, args, kwargs))
+                return future
+
+        def map(self, fn, argsiter, maxinflight=None, ordered=True):
+                """
+                Calls fn for every item of argsiter and yields the outcomes.
+                argsiter is consumed lazily, with at most maxinflight calls queued or running at a time.
+
+                @type Function
+                @param fn - The function to call
+                @type Iterable
+                @param argsiter - Argument tuples for fn (a non-tuple item is passed as the single argument)
+                @type Number
+                @param maxinflight - Maximum number of calls queued or running (defaults to twice the workers)
+                @type Bool
+                @param ordered - Yield in submission order if True, in completion order otherwise
+                @rtype Generator
+                @return (args, result) tuples, where result is the value returned by fn or the exception it raised
+                """
+                maxinflight = maxinflight or 2 * self.workers
+                argsiter    = iter(argsiter)
+                pending     = collections.deque()
+                finished    = Queue.Queue()
+                exhausted   = False
+                while True:
+                        while not exhausted and len(pending) < maxinflight:
+                                try:
+                                        args = next(argsiter)
+                                except StopIteration:
+                                        exhausted = True
+                                        break
+                                if not isinstance(args, tuple):
+                                        args = (args,)
+                                future = self.submit(fn, *args)
+                                if not ordered:
+                                        future.addDoneCallback(lambda future, args=args: finished.put((args, future)))
+                                pending.append((args, future))
+                        if not pending:
+                                return
+                        if ordered:
+                                args, future = pending.popleft()
+                        else:
+                                args, future = finished.get()
+                                pending.remove((args, future))
+                        error = future.exception()
+                        yield args, (error if error is not None else future.result())
+
+        def shutdown(self, wait=True):
+                """
+                Stops the worker threads once the queued calls have run.
+
+                @type Bool
+                @param wait - Whether to block until the workers have finished
+                """
+                with self.__lock:
+                        threads, self.__threads = self.__threads, []
+                for thread in threads:
+                        self.__queue.put(None)
+                if wait:
+                        for thread in threads:
+                                thread.join()
+
+        def __start(self):
+                with self.__lock:
+                        while len(self.__threads) < self.workers:
+                                thread = threading.Thread(target=self.__work)
+                                thread.daemon = True
+                                thread.start()
+                                self.__threads.append(thread)
+
+        def __work(self):
+                while True:
+                        task = self.__queue.get()
+                        if task is None:
+                                return
+                        future, fn, args, kwargs = task
+                        if self.limiter is not None:
+                                self.limiter.acquire()
+                        try:
+                                result = fn(*args, **kwargs)
+                        except Exception, err:
+                                future.setError(err)
+                        else:
+                                future.setResult(result)
+
+
+class SaploMemoryCache:
+        """
+        In-memory LRU cache for SaploJSONClient responses. Safe to share between threads.
+        Responses are kept JSON encoded, so like SaploSqliteCache every get returns a fresh copy.
+        """
+        def __init__(self, maxsize=10000):
+                """
+                @type Number
+                @param maxsize - The maximum number of responses kept, the least recently used are evicted first
+                """
+                self.maxsize  = maxsize
+                self.__items  = collections.OrderedDict()
+                self.__lock   = threading.Lock()
+
+        def get(self, key):
+                with self.__lock:
+                        item = self.__items.pop(key, None)
+                        if item is None or item[0] < time.time():
+                                return None
+                        self.__items[key] = item
+                return json.loads(item[1])
+
+        def set(self, key, value, ttl):
+                encoded = json.dumps(value)
+                with self.__lock:
+                        self.__items.pop(key, None)
+                        self.__items[key] = (time.time() + ttl, encoded)
+                        while len(self.__items) > self.maxsize:
+                                self.__items.popitem(last=False)
+
+        def delete(self, key):
+                with self.__lock:
+                        self.__items.pop(key, None)
+
+        def deletePrefix(self, prefix):
+                with self.__lock:
+                        for key in [key for key in self.__items if key.startswith(prefix)]:
+                                del self.__items[key]
+
+        def clear(self):
+                with self.__lock:
+                        self.__items.clear()
+
+
+class SaploSqliteCache:
+        """
+        On-disk cache for SaploJSONClient responses, backed by sqlite.
+        Survives restarts and can be shared by several processes using the same file.
+        """
+        def __init__(self, path):
+                """
+                @type String
+                @param path - The sqlite database file
+                """
+                self.path   = path
+                self.__lock = threading.Lock()
+                self.__db   = sqlite3.connect(path, check_same_thread=False)
+                self.__db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+                self.__db.commit()
+
+        def get(self, key):
+                with self.__lock:
+                        row = self.__db.execute("SELECT expires, value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None or row[0] < time.time():
+                        return None
+                return json.loads(row[1])
+
+        def set(self, key, value, ttl):
+                with self.__lock:
+                        self.__db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                                        (key, time.time() + ttl, json.dumps(value)))
+                        self.__db.commit()
+
+        def delete(self, key):
+                with self.__lock:
+                        self.__db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                        self.__db.commit()
+
+        def deletePrefix(self, prefix):
+                with self.__lock:
+                        self.__db.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+                        self.__db.commit()
+
+        def clear(self):
+                with self.__lock:
+                        self.__db.execute("DELETE FROM cache")
+                        self.__db.commit()
+
+        def close(self):
+                with self.__lock:
+                        self.__db.close()
+
+
+class SaploMetrics:
+        """
+        Per-method request counters and latency histograms for SaploJSONClient.
+
+        For every JSON-RPC method (batches are recorded as 'batch') it counts requests, errors, bytes sent and
+        received, and records the latency of three phases: connect (opening a connection, 0 when one is reused),
+        wait (sending the request and receiving the response) and decode (parsing the JSON response).
+        Safe to share between clients and threads.
+
+        Example of usage:
+                client = SaploJSONClient(apikey, secretkey)
+                ...
+                print client.metrics.snapshot()['corpus.addArticle']['wait']['p95']
+                print client.metrics.prometheus()
+        """
+        phases  = ('connect', 'wait', 'decode')
+        #Upper bounds in seconds of the histogram buckets used for the Prometheus export
+        buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+        def __init__(self, samples=2048):
+                """
+                @type Number
+                @param samples - How many of the latest latencies per method and phase the percentiles are computed from
+                """
+                self.samples  = samples
+                self.__lock   = threading.Lock()
+                self.__methods = {}
+
+        def record(self, meth, info):
+                """
+                Records one request.
+
+                @type String
+                @param meth - The JSON-RPC method
+                @type Dictionary
+                @param info - The request info as passed to post request hooks (sent, received, error and the phase latencies)
+                """
+                with self.__lock:
+                        stats = self.__methods.get(meth)
+                        if stats is None:
+                                stats = self.__methods[meth] = dict(requests = 0, errors = 0, sent = 0, received = 0,
+                                                latency = dict((phase, dict(sum = 0.0, buckets = [0] * (len(self.buckets) + 1),
+                                                                samples = collections.deque(maxlen = self.samples)))
+                                                        for phase in self.phases))
+                        stats['requests'] += 1
+                        stats['errors']   += 1 if info.get('error') is not None else 0
+                        stats['sent']     += info.get('sent', 0)
+                        stats['received'] += info.get('received', 0)
+                        for phase in self.phases:
+                                seconds = info.get(phase)
+                                if seconds is None:
+                                        continue
+                                latency = stats['latency'][phase]
+                                latency['sum'] += seconds
+                                latency['buckets'][self.__bucket(seconds)] += 1
+                                latency['samples'].append(seconds)
+
+        def snapshot(self):
+                """
+                @rtype Dictionary
+                @return For every method: requests, errors, sent and received bytes, and for every phase
+                        the count, sum, p50, p95 and p99 latency in seconds
+                """
+                with self.__lock:
+                        snapshot = {}
+                        for meth, stats in self.__methods.items():
+                                snapshot[meth] = dict((name, stats[name]) for name in ('requests', 'errors', 'sent', 'received'))
+                                for phase, latency in stats['latency'].items():
+                                        samples = sorted(latency['samples'])
+                                        snapshot[meth][phase] = dict(count = sum(latency['buckets']), sum = latency['sum'],
+                                                        p50 = self.__percentile(samples, 0.50),
+                                                        p95 = self.__percentile(samples, 0.95),
+                                                        p99 = self.__percentile(samples, 0.99))
+                return snapshot
+
+        def prometheus(self, prefix='saplo'):
+                """
+                @rtype String
+                @return The metrics in the Prometheus text exposition format
+                """
+                lines = []
+                with self.__lock:
+                        methods = sorted(self.__methods.items())
+                        for name, key, help in (('requests_total', 'requests', 'Requests sent'),
+                                                ('errors_total', 'errors', 'Requests that failed or returned an error'),
+                                                ('sent_bytes_total', 'sent', 'Request body bytes sent'),
+                                                ('received_bytes_total', 'received', 'Response body bytes received')):
+                                lines.append('# HELP %s_%s %s' % (prefix, name, help))
+                                lines.append('# TYPE %s_%s counter' % (prefix, name))
+                                for meth, stats in methods:
+                                        lines.append('%s_%s{method="%s"} %d' % (prefix, name, meth, stats[key]))
+                        lines.append('# HELP %s_request_seconds Request latency per phase' % prefix)
+                        lines.append('# TYPE %s_request_seconds histogram' % prefix)
+                        for meth, stats in methods:
+                                for phase in self.phases:
+                                        latency = stats['latency'][phase]
+                                        labels  = 'method="%s",phase="%s"' % (meth, phase)
+                                        count   = 0
+                                        for bound, inbucket in zip(self.buckets + ('+Inf',), latency['buckets']):
+                                                count += inbucket
+                                                lines.append('%s_request_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, bound, count))
+                                        lines.append('%s_request_seconds_sum{%s} %f' % (prefix, labels, latency['sum']))
+                                        lines.append('%s_request_seconds_count{%s} %d' % (prefix, labels, count))
+                return '\n'.join(lines) + '\n'
+
+        def reset(self):
+                with self.__lock:
+                        self.__methods = {}
+
+        def __bucket(self, seconds):
+                for index, bound in enumerate(self.buckets):
+                        if seconds <= bound:
+                                return index
+                return len(self.buckets)
+
+        def __percentile(self, samples, fraction):
+                if not samples:
+                        return None
+                return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
 class SaploJSONClient:
         """
          Saplo JSON Client.
@@ -37,19 +988,123 @@ class SaploJSONClient:
         apikey      = ''
         secretkey   = ''
         token       = ''
+        batchsupported = True
+
+        #HTTP statuses with which a server rejects JSON-RPC batches. The client then sends calls one by one.
+        batchrejectedstatuses = (400, 404, 405, 415, 501)
+
+        #JSON-RPC error codes with which a server answers a batch it does not understand: invalid params
+        #or method not found, and the JSON-RPC 2.0 invalid request. Errors whose message mentions
+        #batches are treated the same way, other errors are raised.
+        batchrejectedcodes = (400, 404, -32600, -32601)
+
+        #Compressed response encodings the client accepts, None to ask for uncompressed responses
+        acceptencoding  = 'gzip, deflate'
+        #Encoding for request bodies of at least compressminsize bytes, 'gzip', 'deflate' or None.
+        #Only enable it for servers that accept compressed requests.
+        requestencoding = None
+        compressminsize = 1024
+        #Bytes read from the socket at a time by the streaming methods
+        streamchunksize = 16384
+
+        #Retry settings: how many times a failed idempotent call is retried, the backoff before the
+        #first retry (doubled for every further retry, up to maxbackoff) and the maximum number of
+        #seconds a call may take including all retries (None for no limit)
+        retries     = 3
+        backoff     = 0.5
+        maxbackoff  = 10.0
+        deadline    = None
+
+        #Error codes that mean the session token is no longer valid. Errors whose message mentions
+        #the session are treated the same way.
+        sessionerrorcodes = ()
+
+        #Error codes that mean the requested corpus, article or context does not exist. Errors whose
+        #message says so are treated the same way.
+        notfounderrorcodes = (410,)
+
+        #Seconds a session token is kept in the token cache and reused by new clients. A reused token
+        #that the server has already expired is replaced on the first call anyway.
+        sessionttl  = 1800
+
+        #Calls that can safely be sent again after a timeout or server error.
+        #addArticle is included since the server returns the existing article for a duplicate.
+        idempotentmethods = ('corpus.getArticle', 'corpus.getInfo', 'corpus.getPermissions', 'corpus.addArticle',
+                        'tags.getEntityTags', 'match.getSimilarArticles', 'context.listContexts',
+                        'context.getContextSimilarity')
+
+        #Seconds a cached response stays valid, per method. Methods not listed here are never cached.
+        cachettl    = {
+                'corpus.getArticle':        3600,
+                'corpus.getInfo':           60,
+                'corpus.getPermissions':    300,
+                'context.listContexts':     300,
+                'tags.getEntityTags':       86400,
+                'match.getSimilarArticles': 3600,
+                }
+
+        __articlefields = ('headline', 'lead', 'body', 'publishStart', 'publishUrl', 'authors', 'lang')
+
+        #The params that identify a cached response, the wait params do not change the result
+        __cachekeyparams = {
+                'tags.getEntityTags':       lambda params: params[:2],
+                'match.getSimilarArticles': lambda params: list(params[:2]) + list(params[3:]),
+                }
+        #Methods whose results are only cached once the server has finished computing them
+        __cachewhencomplete = ('tags.getEntityTags', 'match.getSimilarArticles')
                         
-        def __init__(self,apikey, secretkey, token=None):
+        def __init__(self,apikey, secretkey, token=None, pool=None, cache=None, cachettl=None, retries=None, deadline=None,
+                        metrics=None, codec=None, tokencache=None):
                 """
-                Initiates the Saplo JSONClient using the secret & api keys
+                Initiates the Saplo JSONClient using the secret & api keys.
+                No request is sent until the first call, which creates the session if no token is known.
                 @type String
                 @param Saplo API key
                 @type String
                 @param Saplo Secret key
+                @type String
+                @param token - An existing session token to use instead of creating a new session
+                @type SaploConnectionPool
+                @param pool - Keep-alive connection pool to send requests through.
+                        Pass the same pool to several clients to let them share connections, a private pool is created otherwise.
+                @type SaploMemoryCache
+                @param cache - Cache for the responses of read-only calls (SaploMemoryCache, SaploSqliteCache or
+                        any object with the same methods). Nothing is cached if None. Clients with different API keys
+                        may share a cache, their responses are kept apart.
+                @type Dictionary
+                @param cachettl - Per-method TTLs in seconds overriding the cachettl class defaults, i.e. {'corpus.getInfo': 10}
+                @type Number
+                @param retries - How many times idempotent calls are retried on timeouts and server errors (defaults to retries)
+                @type Float
+                @param deadline - Maximum number of seconds a call may take including retries (defaults to deadline)
+                @type SaploMetrics
+                @param metrics - Where request metrics are recorded. Pass the same object to several clients to aggregate them.
+                @type SaploJSONCodec
+                @param codec - Encodes requests and decodes responses, a SaploJSONCodec using the fastest available library by default
+                @type SaploSqliteCache
+                @param tokencache - Where session tokens are shared with other clients and processes using the same keys
+                        (SaploSqliteCache, SaploMemoryCache or any object with the same methods). Tokens are kept for sessionttl seconds.
                 """
                 self.apikey     = apikey
                 self.secretkey  = secretkey
-                self.token      = token
-                self.__createSession(self.apikey, self.secretkey)
+                self.token      = token or ''
+                self.tokencache = tokencache
+                self.pool       = pool if pool is not None else SaploConnectionPool()
+                self.cache      = cache
+                self.cachettl   = dict(self.cachettl, **(cachettl or {}))
+                #Every account sees its own corpora and contexts
+                self.__cacheprefix = hashlib.sha1(apikey).hexdigest() + ' '
+                if retries is not None:
+                        self.retries = retries
+                if deadline is not None:
+                        self.deadline = deadline
+                self.__sessionlock = threading.Lock()
+                self.metrics    = metrics if metrics is not None else SaploMetrics()
+                self.codec      = codec if codec is not None else SaploJSONCodec()
+                self.__prehooks  = []
+                self.__posthooks = []
+                self.__tokenlock = threading.Lock()
+                self.__local     = threading.local()
                 
         def getArticle(self,corpusId, articleId):
                 """
@@ -67,8 +1122,7 @@ class SaploJSONClient:
                        
                 """
                 params = (corpusId, articleId)
-                response = self.__doRequest('corpus.getArticle', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('corpus.getArticle', params)
                 
         def getEntityTags(self,corpusId, articleId, waiton):
                 """
@@ -88,8 +1142,7 @@ class SaploJSONClient:
                        
                 """
                 params = (corpusId, articleId,waiton)
-                response = self.__doRequest('tags.getEntityTags', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('tags.getEntityTags', params)
                 
         def getSimilarArticles(self,corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold):
                 """
@@ -123,8 +1176,7 @@ class SaploJSONClient:
                 """
 
                 params = [corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold]
-                response = self.__doRequest('match.getSimilarArticles', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('match.getSimilarArticles', params)
                 
         def createCorpus(self,corpusName, corpusDesc, lang):
                 """
@@ -146,8 +1198,7 @@ class SaploJSONClient:
                         corpusId    Int        A unique id for your newly created corpus.
                 """
                 params = (corpusName,corpusDesc,lang)
-                response = self.__doRequest('corpus.createCorpus', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('corpus.createCorpus', params)
                 
         def addArticle(self,corpusId, headline, lead, body, publishStart, publishUrl, authors, lang):
                 '''
@@ -178,21 +1229,163 @@ class SaploJSONClient:
                         articleId   Number        The id for the new article.
                 '''
                 params = (corpusId, headline, lead, body, publishStart, publishUrl, authors,lang)
-                response = self.__doRequest('corpus.addArticle', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('corpus.addArticle', params)
                 
-        def getCorpusPermission(self):
+        def addArticles(self, corpusId, articles, batchsize=100):
                 """
-                Gives you a list to all corpus ids that you have read or write permission to.
+                Adds many articles to a corpus, sending them in batches instead of one request per article.
 
+                @type  Number
+                @param corpusId - The id to the corpus where you want to add your articles.
+                @type  Iterable
+                @param articles - Articles to add. Each article is either a dictionary with the keys
+                        headline, lead, body, publishStart, publishUrl, authors and lang, or a tuple with
+                        those values in the same order as the addArticle params.
+                @type  Number
+                @param batchsize - How many articles to send in each request.
+                @rtype Array
+                @return One response dictionary (as returned by addArticle) or SaploError per article, in the given order
+                """
+                results = []
+                batch   = self.batch()
+                for article in articles:
+                        if isinstance(article, dict):
+                                article = [article.get(field, '') for field in self.__articlefields]
+                        batch.addArticle(corpusId, *article)
+                        if len(batch) >= batchsize:
+                                results.extend(batch.execute())
+                if len(batch):
+                        results.extend(batch.execute())
+                return results
 
-                @rtype Dictionary
-                @return
-                        corpusId    Int        A unique corpus id.
-                        permission    String    The permission you have to the unique corpusId. This can have the values of "read" or "write"
+        def batch(self):
                 """
-                response = self.__doRequest('corpus.getPermissions',() )
-                return self.__handleJSONResponse(response.read())
+                Creates a SaploBatch that sends its calls in a single request using this client's session.
+
+                @rtype SaploBatch
+                """
+                return SaploBatch(self.__doBatch)
+
+        def map(self, methodName, argsiter, workers=8, rate=None, maxinflight=None, ordered=True, executor=None):
+                """
+                Calls one of the client methods for many argument tuples concurrently.
+
+                Example of usage:
+                        args = ((corpusId, articleId, 0) for articleId in articleIds)
+                        for (corpusId, articleId, wait), result in client.map('getEntityTags', args, workers=16, rate=40):
+                                if isinstance(result, SaploError):
+                                        print result
+                                else:
+                                        print result['result']
+
+                @type String
+                @param methodName - The name of the client method to call, i.e. 'getEntityTags'
+                @type Iterable
+                @param argsiter - Argument tuples for the method, consumed lazily
+                @type Number
+                @param workers - Number of concurrent requests
+                @type Float
+                @param rate - Maximum number of requests started per second, None for no limit
+                @type Number
+                @param maxinflight - Maximum number of requests queued or running (defaults to twice the workers)
+                @type Bool
+                @param ordered - Yield results in the order of argsiter if True, as they complete otherwise
+                @type SaploExecutor
+                @param executor - A shared executor to run on instead of a private one (workers and rate are then ignored)
+                @rtype Generator
+                @return (args, result) tuples, where result is the response dictionary or the SaploError the call failed with
+                """
+                method  = getattr(self, methodName)
+                private = executor is None
+                if private:
+                        executor = SaploExecutor(workers, rate)
+                try:
+                        for outcome in executor.map(method, argsiter, maxinflight, ordered):
+                                yield outcome
+                finally:
+                        if private:
+                                executor.shutdown(False)
+
+        def isNotFoundError(self, err):
+                """
+                Tells whether a SaploError means that the requested corpus, article or context does not exist,
+                i.e. to tell a deleted article from a call that failed and may succeed later.
+
+                @type SaploError
+                @param err - The error a call failed with
+                @rtype Bool
+                """
+                message = str(err.value).lower()
+                return err.code in self.notfounderrorcodes or 'does not exist' in message or 'not found' in message
+
+        def isSessionError(self, err):
+                """
+                Tells whether a SaploError means that the session token is no longer valid.
+
+                @type SaploError
+                @param err - The error a call failed with
+                @rtype Bool
+                """
+                return err.code in self.sessionerrorcodes or 'session' in str(err.value).lower()
+
+        def checkResponse(self, response):
+                """
+                Raises the SaploError of a JSON-RPC error response.
+
+                @type Dictionary
+                @param response - A decoded JSON-RPC response
+                @rtype Dictionary
+                @return The response, if it is not an error
+                """
+                return self.__checkResponse(response)
+
+        def session(self, expiredtoken=None):
+                """
+                Creates a session if there is none yet, or replaces expiredtoken if the server has rejected it
+                and no other call has replaced it meanwhile. Session creation is retried like any other call.
+
+                @type String
+                @param expiredtoken - A token the server has rejected
+                @rtype String
+                @return The session token
+                """
+                if expiredtoken is not None:
+                        self.__retry(True, lambda: self.__renewSession(expiredtoken))
+                else:
+                        self.__retry(True, lambda: None)
+                return self.token
+
+        def addRequestHook(self, pre=None, post=None):
+                """
+                Registers functions that are called around every HTTP request the client sends.
+
+                @type Function
+                @param pre - pre(method, body) is called before the request is sent, with the encoded JSON body
+                @type Function
+                @param post - post(method, info) is called when the request has finished or failed. info is a dictionary with
+                        sent        Number   Request body bytes
+                        received    Number   Response body bytes
+                        connect     Float    Seconds spent opening a connection
+                        wait        Float    Seconds spent sending the request and receiving the response
+                        decode      Float    Seconds spent decoding the JSON response
+                        error       Object   The exception or API error code the request failed with, None on success
+                """
+                if pre is not None:
+                        self.__prehooks.append(pre)
+                if post is not None:
+                        self.__posthooks.append(post)
+
+        def getCorpusPermission(self):
+                """
+                Gives you a list to all corpus ids that you have read or write permission to.
+
+
+                @rtype Dictionary
+                @return
+                        corpusId    Int        A unique corpus id.
+                        permission    String    The permission you have to the unique corpusId. This can have the values of "read" or "write"
+                """
+                return self.__call('corpus.getPermissions', ())
                 
         def getCorpusInfo(self,corpusId):
                 """
@@ -209,8 +1402,7 @@ class SaploJSONClient:
                         lastArticleId   Int    The id for the last article that has been added to the corpus.
                 """
                 params = [corpusId]
-                response = self.__doRequest('corpus.getInfo',params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('corpus.getInfo', params)
                 
         def deleteCorpus(self, corpusId):
             """
@@ -223,8 +1415,7 @@ class SaploJSONClient:
                     Bool        Returns whether the corpus was successfully deleted or not.         
             """
             params = [corpusId]
-            response = self.__doRequest('corpus.deleteCorpus',params)
-            return self.__handleJSONResponse(response.read())
+            return self.__call('corpus.deleteCorpus', params)
                 
         def createContext(self,contextName,contextDescription):
                 """
@@ -242,8 +1433,7 @@ class SaploJSONClient:
                         contextId    Int        A unique id for your newly created context.
                 """
                 params = (contextName,contextDescription)
-                response = self.__doRequest('context.createContext', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('context.createContext', params)
                 
         def getContexts(self):
                 """
@@ -255,8 +1445,7 @@ class SaploJSONClient:
                         contextName         String    The context name provided when context was created.
                         contextDescription  String    The context description provided when context was created.
                 """
-                response = self.__doRequest('context.listContexts',())
-                return self.__handleJSONResponse(response.read())
+                return self.__call('context.listContexts', ())
                 
         def deleteContext(self, contextId):
             """
@@ -268,8 +1457,7 @@ class SaploJSONClient:
                     boolean
             """
             params = [contextId]
-            response = self.__doRequest('context.deleteContext',params)
-            return self.__handleJSONResponse(response.read())
+            return self.__call('context.deleteContext', params)
             
         def updateContext(self, contextId, contextName, contextDescription):
             """
@@ -286,8 +1474,7 @@ class SaploJSONClient:
                 boolean
             """
             params = (contextId, contextName, contextDescription)
-            response = self.__doRequest('context.updateContext',params)
-            return self.__handleJSONResponse(response.read())
+            return self.__call('context.updateContext', params)
                           
         def addContextArticles(self, contextId, corpusId, articleIds):
                 """
@@ -309,8 +1496,7 @@ class SaploJSONClient:
                                 'list':articleIds}
 
                 params = [contextId, corpusId,javarpcList]
-                response = self.__doRequest('context.addLikeArticles', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('context.addLikeArticles', params)
                 
         def deleteContextArticles(self, contextId, corpusId, articleIds):
                 """
@@ -332,8 +1518,7 @@ class SaploJSONClient:
                                 'list':articleIds}
 
                 params = [contextId, corpusId,javarpcList]
-                response = self.__doRequest('context.deleteLikeArticles', params)
-                return self.__handleJSONResponse(response.read())
+                return self.__call('context.deleteLikeArticles', params)
                 
         def getContextSimilarity(self, corpusId, articleId, againstContextIds, threshold, limit, wait):
                 """
@@ -363,59 +1548,438 @@ class SaploJSONClient:
                                 'list':againstContextIds}
 
                 params = [corpusId,articleId,javarpcList, threshold, limit, wait]
-                response = self.__doRequest('context.getContextSimilarity', params)
-                return self.__handleJSONResponse(response.read()) 
+                return self.__call('context.getContextSimilarity', params)
+
+        def iterEntityTags(self, corpusId, articleId, waiton):
+                """
+                Streaming version of getEntityTags. The tags are decoded from the socket while the response
+                arrives, instead of reading and decoding the whole response first. Streamed results are not cached.
+                Until the first tag arrives the call is retried like getEntityTags, and the whole response
+                has to arrive within the client's deadline.
+
+                @rtype Generator
+                @return Tag records with the fields tagId, tagWord and tagTypeId
+                """
+                params = (corpusId, articleId, waiton)
+                return self.__stream('tags.getEntityTags', params, Tag)
+
+        def iterSimilarArticles(self, corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold):
+                """
+                Streaming version of getSimilarArticles, see iterEntityTags.
+
+                @rtype Generator
+                @return SimilarArticle records with the fields matchId, resultCorpusId, resultArticleId and resultValue
+                """
+                params = [corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold]
+                return self.__stream('match.getSimilarArticles', params, SimilarArticle)
+
+        def iterContextSimilarity(self, corpusId, articleId, againstContextIds, threshold, limit, wait):
+                """
+                Streaming version of getContextSimilarity, see iterEntityTags.
+
+                @rtype Generator
+                @return ContextSimilarity records with the fields contextId and SemanticResultValue
+                """
+                #Json-rpc-java compatible list
+                javarpcList = {'javaClass':"java.util.ArrayList",
+                                'list':againstContextIds}
+
+                params = [corpusId,articleId,javarpcList, threshold, limit, wait]
+                return self.__stream('context.getContextSimilarity', params, ContextSimilarity)
         
-        def __createSession(self,apiKey, secretKey):
+        def __createSession(self,apiKey, secretKey, expiredtoken=None):
                 """
-                Creates a session towards the Saplo API
+                Creates a session towards the Saplo API, or reuses the token another client stored in the token cache
 
                 @type String
                 @param apikey - The apikey to access the Saplo API
                 @type String
                 @param secretkey - The secret key to access the Saplo API
+                @type String
+                @param expiredtoken - A token the server has rejected, which is not reused from the token cache
                 """
+                key = 'auth.createSession ' + hashlib.sha1(apiKey + '\0' + secretKey).hexdigest()
+                if self.tokencache is not None:
+                        token = self.tokencache.get(key)
+                        if token and token != expiredtoken:
+                                self.__setTokenTo(token)
+                                return
+
                 #Request a new session
                 response = self.__doRequest('auth.createSession',(apiKey,secretKey))
                
-                # Get the response
-                jsonresponse = response.read()
                 #If our request fails, raise an SaploException
-                try:
-                        self.__handleJSONResponse(jsonresponse)
-                except SaploError, err:
-                        raise err
-                #Decode the JSON request and retrieve the token,establishing it as our given token
-                result = json.loads(jsonresponse)
+                result = self.__checkResponse(response)
+                #Retrieve the token, establishing it as our given token
                 token  = result['result']
                 self.__setTokenTo(token)
+                if self.tokencache is not None:
+                        self.tokencache.set(key, token, self.sessionttl)
+
+        def __ensureSession(self):
+                '''
+                Creates the session before the first call, unless a token was given or is cached
+                '''
+                if self.token:
+                        return
+                with self.__sessionlock:
+                        if not self.token:
+                                self.__createSession(self.apikey, self.secretkey)
                 
+        def __call(self, meth, params):
+                '''
+                Sends a JSON-RPC call and returns the response dictionary,
+                answering read-only calls from the cache when possible
+                '''
+                key = self.__cacheKey(meth, params)
+                if key is not None:
+                        response = self.cache.get(key)
+                        if response is not None:
+                                return response
+
+                send = lambda: self.__checkResponse(self.__doRequest(meth, params))
+                response = self.__retry(meth in self.idempotentmethods, send)
+
+                if key is not None and (meth not in self.__cachewhencomplete or response.get('result')):
+                        self.cache.set(key, response, self.cachettl[meth])
+                self.__invalidate(meth, params)
+                return response
+
+        def __cacheKey(self, meth, params, complete=True):
+                '''
+                Returns the cache key for a call, prefixed with a hash of the API key, or None if the call is not cached.
+                Without complete, the key is a prefix matching every call whose params start with the given ones
+                '''
+                if self.cache is None or meth not in self.cachettl:
+                        return None
+                keyparams = self.__cachekeyparams.get(meth)
+                if keyparams is not None and complete:
+                        params = keyparams(params)
+                key = self.__cacheprefix + meth + ' ' + json.dumps(list(params))
+                return key if complete else key[:-1] + (',' if params else '')
+
+        def __invalidate(self, meth, params):
+                '''
+                Drops the cached responses that a mutating call makes stale
+                '''
+                if self.cache is None:
+                        return
+                if meth == 'corpus.addArticle':
+                        self.__drop('corpus.getInfo', params[:1])
+                elif meth == 'corpus.createCorpus':
+                        self.__drop('corpus.getPermissions', ())
+                elif meth == 'corpus.deleteCorpus':
+                        self.__drop('corpus.getPermissions', ())
+                        self.__drop('corpus.getInfo', params[:1])
+                        for cached in ('corpus.getArticle', 'tags.getEntityTags', 'match.getSimilarArticles'):
+                                self.__drop(cached, params[:1], False)
+                elif meth in ('context.createContext', 'context.updateContext', 'context.deleteContext'):
+                        self.__drop('context.listContexts', ())
+
+        def __drop(self, meth, params, complete=True):
+                key = self.__cacheKey(meth, params, complete)
+                if key is None:
+                        return
+                if complete:
+                        self.cache.delete(key)
+                else:
+                        self.cache.deletePrefix(key)
+
+        def __doBatch(self, calls):
+                '''
+                Sends a list of (method, params) calls as one JSON-RPC batch and returns
+                a response dictionary or SaploError for each call, in order
+                '''
+                idempotent = all(meth in self.idempotentmethods for meth, param in calls)
+                if self.batchsupported:
+                        results = self.__retry(idempotent, lambda: self.__sendBatch(calls))
+                        if results is not None:
+                                for meth, param in calls:
+                                        self.__invalidate(meth, param)
+                                return results
+                        #The server does not understand batches, pipeline the calls from now on
+                        self.batchsupported = False
+
+                results = []
+                for sapid, (meth, param) in enumerate(calls, 1):
+                        send = lambda: self.__checkResponse(self.__doRequest(meth, param, sapid))
+                        try:
+                                results.append(self.__retry(meth in self.idempotentmethods, send))
+                        except SaploError, err:
+                                results.append(err)
+                        self.__invalidate(meth, param)
+                return results
+
+        def __sendBatch(self, calls):
+                '''
+                Posts the calls as one JSON-RPC batch, returning None if the server rejects batches.
+                Raises session errors, other errors answered to the whole batch and any other HTTP error,
+                so __retry can renew the session or retry.
+                '''
+                requests = [dict(method = meth, params = param, id = sapid)
+                                for sapid, (meth, param) in enumerate(calls, 1)]
+                try:
+                        response = self.__exchange('batch', self.codec.dumps(requests))
+                except urllib2.HTTPError, err:
+                        if err.code in self.batchrejectedstatuses:
+                                return None
+                        raise
+                if isinstance(response, dict) and 'error' in response:
+                        #A single error instead of a list of responses
+                        error = self.__batchResult(response)
+                        if self.isSessionError(error) or not self.__isBatchRejection(error):
+                                raise error
+                        return None
+                if not isinstance(response, list):
+                        raise SaploError("An error has occured: 'Malformed batch response' With code = ()")
+                byid = dict((item.get('id'), item) for item in response if isinstance(item, dict))
+                results = [self.__batchResult(byid.get(sapid)) for sapid in range(1, len(calls) + 1)]
+                for result in results:
+                        if isinstance(result, SaploError) and self.isSessionError(result):
+                                raise result
+                return results
+
+        def __isBatchRejection(self, err):
+                '''
+                Tells whether an error answered to a whole batch means that the server does not support batches
+                '''
+                return err.code in self.batchrejectedcodes or 'batch' in str(err.value).lower()
+
+        def __retry(self, idempotent, send):
+                '''
+                Runs send(), creating a new session and trying again if the session has expired, and
+                retrying idempotent calls that time out or hit a server error with exponential backoff.
+                Every request sent meanwhile, including the ones creating the session, times out when the deadline passes.
+                '''
+                start   = time.time()
+                attempt = 0
+                renewed = False
+                expired = None
+                outer   = getattr(self.__local, 'deadline', None)
+                if self.deadline is not None:
+                        self.__local.deadline = min(outer or float('inf'), start + self.deadline)
+                try:
+                        while True:
+                                token    = self.token
+                                creating = True
+                                try:
+                                        #Creating the session is retried like the call itself, it is always safe to send again
+                                        if expired is not None:
+                                                self.__renewSession(expired)
+                                                expired = None
+                                        self.__ensureSession()
+                                        token    = self.token
+                                        creating = False
+                                        return send()
+                                except SaploError, err:
+                                        if renewed or not self.isSessionError(err):
+                                                raise
+                                        renewed = True
+                                        expired = token
+                                        continue
+                                except (socket.error, httplib.HTTPException, urllib2.URLError), err:
+                                        #Throttled requests are retried like server errors
+                                        if isinstance(err, urllib2.HTTPError) and err.code < 500 and err.code != 429:
+                                                raise
+                                        if not (idempotent or creating) or attempt >= self.retries:
+                                                raise
+                                delay = min(self.maxbackoff, self.backoff * 2 ** attempt)
+                                attempt += 1
+                                if self.deadline is not None and time.time() + delay - start > self.deadline:
+                                        raise
+                                time.sleep(delay)
+                finally:
+                        self.__local.deadline = outer
+
+        def __renewSession(self, expiredtoken):
+                '''
+                Creates a new session, unless another thread already replaced the expired token
+                '''
+                with self.__sessionlock:
+                        if self.token == expiredtoken:
+                                self.__createSession(self.apikey, self.secretkey, expiredtoken)
+
+        def __batchResult(self, response):
+                '''
+                Returns the response of a single batched call, or the SaploError it failed with
+                '''
+                if response is None:
+                        return SaploError("An error has occured: 'No response for batched call' With code = ()")
+                try:
+                        return self.__checkResponse(response)
+                except SaploError, err:
+                        return err
+
         def __doRequest(self, meth, param,sapid=0):
                 '''
-                Creates an JSON request to the server from the params
+                Creates an JSON request to the server from the params and returns the decoded response
                 '''
                 #HTTP params
-                options = json.dumps(dict(
+                options = self.codec.dumps(dict(
                         method = meth,
                         params = param,
                         id=sapid))
-                        
+                return self.__exchange(meth, options)
+
+        def __exchange(self, meth, options):
+                '''
+                Posts an encoded JSON request, decodes the response and records how it went
+                '''
+                options, headers, info = self.__prepare(meth, options)
+                try:
+                        response = self.__post(options, headers)
+                        body     = response.read()
+                        info.update(connect = response.connecttime, wait = response.waittime, received = response.received)
+                        start    = time.time()
+                        result   = self.codec.loads(self.__decompress(body, response.headers.getheader('Content-Encoding')))
+                        info['decode'] = time.time() - start
+                        if isinstance(result, dict) and 'error' in result:
+                                info['error'] = result['error'].get('code', '') if isinstance(result['error'], dict) else result['error']
+                        return result
+                except Exception, err:
+                        info['error'] = err
+                        raise
+                finally:
+                        self.metrics.record(meth, info)
+                        for hook in self.__posthooks:
+                                hook(meth, info)
+
+        def __stream(self, meth, params, record):
+                '''
+                Sends a call and yields the items of its result list as records while the response is read.
+                Everything up to the first item is retried like any other call, renewing an expired session and
+                retrying timeouts and server errors. Once items have been yielded an error is raised to the caller.
+                '''
+                items = self.__retry(meth in self.idempotentmethods, lambda: self.__startStream(meth, params, record))
+                for item in items:
+                        yield item
+
+        def __startStream(self, meth, params, record):
+                '''
+                Sends a streamed call and waits for its first item, returning an iterator over all the items
+                '''
+                items = self.__streamOnce(meth, params, record)
+                try:
+                        first = next(items)
+                except StopIteration:
+                        return iter(())
+                return itertools.chain((first,), items)
+
+        def __streamOnce(self, meth, params, record):
+                options = self.codec.dumps(dict(method = meth, params = params, id = 0))
+                options, headers, info = self.__prepare(meth, options)
+                decoder = SaploStreamDecoder()
+                info['decode'] = 0.0
+                response = None
+                #The deadline of the call also covers the items read after __retry has returned
+                deadline = getattr(self.__local, 'deadline', None)
+                try:
+                        response   = self.__post(options, headers)
+                        decompress = self.__decompressor(response.headers.getheader('Content-Encoding'))
+                        while True:
+                                if deadline is not None and time.time() > deadline:
+                                        raise socket.timeout("Deadline exceeded")
+                                chunk = response.read(self.streamchunksize)
+                                start = time.time()
+                                items = decoder.feed(decompress(chunk)) if chunk else []
+                                info['decode'] += time.time() - start
+                                for item in items:
+                                        yield record(*[item.get(field) for field in record._fields])
+                                if not chunk:
+                                        break
+                        info.update(connect = response.connecttime, wait = response.waittime, received = response.received)
+                        decoder.close()
+                        self.__checkResponse(decoder.response)
+                except Exception, err:
+                        info['error'] = getattr(err, 'code', None) or err
+                        raise
+                finally:
+                        #Hands the connection back, or drops it if the caller stopped reading early
+                        if response is not None:
+                                response.close()
+                        self.metrics.record(meth, info)
+                        for hook in self.__posthooks:
+                                hook(meth, info)
+
+        def __prepare(self, meth, options):
+                '''
+                Runs the pre request hooks and returns the request body, compressed if configured,
+                its headers and the info dictionary to record the request in
+                '''
+                for hook in self.__prehooks:
+                        hook(meth, options)
+                headers = {}
+                if self.acceptencoding:
+                        headers['Accept-Encoding'] = self.acceptencoding
+                if self.requestencoding and len(options) >= self.compressminsize:
+                        options = self.__compress(options, self.requestencoding)
+                        headers['Content-Encoding'] = self.requestencoding
+                info = dict(sent = len(options), received = 0, connect = None, wait = None, decode = None, error = None)
+                return options, headers, info
+
+        def __post(self, options, headers=None):
+                '''
+                Posts an encoded JSON request body to the server
+                '''
                 #Parse the url-string to contain our session-token
-                url = self.url.format(token = self.token)
+                with self.__tokenlock:
+                        url = self.url.format(token = self.token)
+
+                #Requests sent by a call with a deadline time out when it passes
+                timeout  = None
+                deadline = getattr(self.__local, 'deadline', None)
+                if deadline is not None:
+                        timeout = deadline - time.time()
+                        if timeout <= 0:
+                                raise socket.timeout("Deadline exceeded")
 
-                #Create HTTP request
-                request  = urllib2.Request(url,options)
-                response = urllib2.urlopen(request)
+                #Send the request over a kept-alive connection from the pool
+                response = self.pool.urlopen(url, options, headers, timeout)
                 return response
+
+        def __compress(self, data, encoding):
+                if encoding == 'gzip':
+                        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                        return compressor.compress(data) + compressor.flush()
+                return zlib.compress(data, 6)
+
+        def __decompress(self, data, encoding):
+                encoding = (encoding or '').strip().lower()
+                if encoding in ('gzip', 'x-gzip'):
+                        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+                if encoding == 'deflate':
+                        #Some servers send raw deflate data without the zlib header
+                        try:
+                                return zlib.decompress(data)
+                        except zlib.error:
+                                return zlib.decompress(data, -zlib.MAX_WBITS)
+                return data
+
+        def __decompressor(self, encoding):
+                '''
+                Returns a function that decompresses a response body chunk by chunk
+                '''
+                encoding = (encoding or '').strip().lower()
+                if encoding in ('gzip', 'x-gzip'):
+                        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+                if encoding != 'deflate':
+                        return lambda chunk: chunk
+                state = {}
+                def decompress(chunk):
+                        if 'decompressor' not in state:
+                                #A zlib header starts with 0x78, otherwise the data is raw deflate
+                                state['decompressor'] = zlib.decompressobj(zlib.MAX_WBITS if chunk[:1] == '\x78' else -zlib.MAX_WBITS)
+                        return state['decompressor'].decompress(chunk)
+                return decompress
                 
         def __setTokenTo(self, t):
                 '''
                 Sets the class token string to the given param
                 '''
-                self.token = t;
+                with self.__tokenlock:
+                        self.token = t;
                 
-        def __handleJSONResponse(self, jsonresponse):
-                response = json.loads(jsonresponse)
+        def __checkResponse(self, response):
                 #If errors, handle them
                 if "error" in response:
                         errormsg  =  "Unknown error" if ('msg'  not in response['error']) else response['error']['msg']
@@ -427,6 +1991,936 @@ class SaploJSONClient:
                                         errorcode    = errorcode,
                                         );
                         #Raise an SaploError
-                        raise SaploError(msg)
+                        raise SaploError(msg, errorcode)
                 ##Otherwise we have a sucessfull response
-                return response     
+                return response
+
+
+class SaploEventLoop:
+        """
+        Runs callbacks, timers and non-blocking socket handlers on one background thread.
+
+        Ready sockets are found with poll (or select where poll is not available), so a single thread can
+        wait on hundreds of connections. Other threads hand work to the loop with callSoon, which wakes it up
+        through a pipe. All the other methods may only be called on the loop thread.
+        """
+        def __init__(self):
+                self.__watched  = {}
+                self.__timers   = []
+                self.__sequence = 0
+                self.__soon     = collections.deque()
+                self.__lock     = threading.Lock()
+                self.__stopped  = False
+                self.__wakeread, self.__wakewrite = os.pipe()
+                self.__thread   = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        def callSoon(self, fn, *args):
+                """
+                Runs fn(*args) on the loop thread. Safe to call from any thread.
+                """
+                with self.__lock:
+                        if self.__wakewrite is None:
+                                #The loop has stopped
+                                return
+                        #The loop takes all queued callbacks at once, so it only needs waking for the first one
+                        if not self.__soon:
+                                os.write(self.__wakewrite, 'x')
+                        self.__soon.append((fn, args))
+
+        def callLater(self, delay, fn, *args):
+                """
+                Runs fn(*args) after delay seconds.
+
+                @rtype Dictionary
+                @return The timer, which can be passed to cancel
+                """
+                self.__sequence += 1
+                timer = dict(fn = fn, args = args, cancelled = False)
+                heapq.heappush(self.__timers, (time.time() + delay, self.__sequence, timer))
+                return timer
+
+        def cancel(self, timer):
+                if timer is not None:
+                        timer['cancelled'] = True
+
+        def watch(self, fd, handler, read, write):
+                """
+                Calls handler() whenever the file descriptor is readable (if read) or writable (if write),
+                replacing what it was watched for before.
+                """
+                self.__watched[fd] = (handler, read, write)
+
+        def unwatch(self, fd):
+                self.__watched.pop(fd, None)
+
+        def stop(self):
+                """
+                Stops the loop once the callbacks queued so far have run. Safe to call from any thread.
+                """
+                self.callSoon(self.__stop)
+
+        def join(self):
+                """
+                Waits for the loop thread to stop.
+                """
+                if threading.current_thread() is not self.__thread:
+                        self.__thread.join()
+
+        def __stop(self):
+                self.__stopped = True
+
+        def __run(self):
+                try:
+                        while not self.__stopped:
+                                with self.__lock:
+                                        soon, self.__soon = self.__soon, collections.deque()
+                                for fn, args in soon:
+                                        self.__invoke(fn, args)
+                                now = time.time()
+                                while self.__timers and self.__timers[0][0] <= now and not self.__stopped:
+                                        timer = heapq.heappop(self.__timers)[2]
+                                        if not timer['cancelled']:
+                                                self.__invoke(timer['fn'], timer['args'])
+                                if self.__stopped:
+                                        break
+                                timeout = None
+                                if self.__timers:
+                                        timeout = max(0.0, self.__timers[0][0] - time.time())
+                                with self.__lock:
+                                        if self.__soon:
+                                                timeout = 0.0
+                                watched = dict(self.__watched)
+                                for fd in self.__wait(watched, timeout):
+                                        #Skip handlers that have been replaced or removed since the wait started
+                                        if fd in watched and self.__watched.get(fd) is watched[fd]:
+                                                self.__invoke(watched[fd][0], ())
+                finally:
+                        with self.__lock:
+                                os.close(self.__wakeread)
+                                os.close(self.__wakewrite)
+                                self.__wakewrite = None
+
+        def __wait(self, watched, timeout):
+                '''
+                Waits for at most timeout seconds and returns the watched file descriptors that are ready
+                '''
+                try:
+                        if hasattr(select, 'poll'):
+                                poller = select.poll()
+                                poller.register(self.__wakeread, select.POLLIN)
+                                for fd, (handler, read, write) in watched.items():
+                                        poller.register(fd, (select.POLLIN if read else 0) | (select.POLLOUT if write else 0))
+                                events = poller.poll(None if timeout is None else int(math.ceil(timeout * 1000)))
+                                ready  = [fd for fd, event in events]
+                        else:
+                                readers = [fd for fd, (handler, read, write) in watched.items() if read]
+                                writers = [fd for fd, (handler, read, write) in watched.items() if write]
+                                readable, writable, failed = select.select(readers + [self.__wakeread], writers, writers, timeout)
+                                ready = set(readable + writable + failed)
+                except (select.error, OSError), err:
+                        if err.args[0] == errno.EINTR:
+                                return []
+                        raise
+                if self.__wakeread in ready:
+                        os.read(self.__wakeread, 4096)
+                return [fd for fd in ready if fd != self.__wakeread]
+
+        def __invoke(self, fn, args):
+                try:
+                        fn(*args)
+                except Exception:
+                        traceback.print_exc()
+
+
+class SaploAsyncConnection:
+        """
+        Non-blocking HTTP/1.1 keep-alive connection, driven by a SaploEventLoop.
+
+        Sends one request at a time. Between requests the idle connection is watched, so that it is
+        closed as soon as the server closes its end and is never reused after that.
+        """
+        def __init__(self, loop, key, sslcontext=None):
+                """
+                @type SaploEventLoop
+                @param loop - The loop running the connection
+                @type Tuple
+                @param key - (scheme, host, port) to connect to
+                @type ssl.SSLContext
+                @param sslcontext - Context for https connections
+                """
+                self.loop       = loop
+                self.key        = key
+                self.sslcontext = sslcontext
+                self.sock       = None
+                self.state      = 'new'
+                self.requests   = 0
+                self.idlesince  = None
+                self.__fd       = None
+                self.__callback = None
+
+        def request(self, path, headers, body, callback):
+                """
+                Posts body to path.
+
+                @type Function
+                @param callback - callback(error, response) is called once on a later loop iteration, with the socket
+                        or HTTP error the request failed with, or a dictionary with the status, reason, headers (lowercase
+                        names), body and connecttime (seconds spent opening the connection) of the response
+                """
+                self.__callback    = callback
+                self.__sent        = 0
+                self.__in          = ''
+                self.__head        = None
+                self.__body        = []
+                self.__bodysize    = 0
+                self.__received    = 0
+                self.__chunk       = None
+                self.__start       = time.time()
+                self.__connecttime = 0.0
+                self.requests     += 1
+                try:
+                        scheme, host, port = self.key
+                        lines = ['POST %s HTTP/1.1' % path, 'Host: %s' % (host if port is None else '%s:%d' % (host, port)),
+                                 'Content-Length: %d' % len(body)]
+                        lines.extend('%s: %s' % header for header in headers.items())
+                        self.__out = str('\r\n'.join(lines) + '\r\n\r\n') + body
+                        if self.sock is None:
+                                self.__connect()
+                        else:
+                                self.state = 'sending'
+                                self.loop.watch(self.__fd, self.__step, False, True)
+                except Exception, err:
+                        self.loop.callSoon(self.__fail, err)
+
+        def abort(self, error):
+                """
+                Fails the request in progress with error and closes the connection.
+                """
+                if self.__callback is not None:
+                        self.__fail(error)
+
+        def close(self):
+                if self.sock is not None:
+                        self.loop.unwatch(self.__fd)
+                        self.sock.close()
+                        self.sock = None
+                self.state = 'closed'
+
+        def __connect(self):
+                scheme, host, port = self.key
+                port = port or (443 if scheme == 'https' else 80)
+                family, socktype, proto, name, address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+                self.sock  = socket.socket(family, socktype, proto)
+                self.__fd  = self.sock.fileno()
+                self.sock.setblocking(0)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.state = 'connecting'
+                error = self.sock.connect_ex(address)
+                if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        raise socket.error(error, os.strerror(error))
+                self.loop.watch(self.__fd, self.__step, False, True)
+
+        def __step(self):
+                '''
+                Moves the connection on as far as the socket allows
+                '''
+                try:
+                        if self.state == 'connecting':
+                                self.__connected()
+                        elif self.state == 'handshake':
+                                self.__handshake()
+                        elif self.state == 'sending':
+                                self.__write()
+                        elif self.state == 'reading':
+                                self.__read()
+                        elif self.state == 'idle':
+                                #The server sends nothing on an idle connection, it has been closed from the other end
+                                self.close()
+                except (socket.error, httplib.HTTPException), err:
+                        self.__fail(err)
+
+        def __connected(self):
+                error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                        raise socket.error(error, os.strerror(error))
+                self.__connecttime = time.time() - self.__start
+                if self.key[0] == 'https':
+                        self.sock  = self.sslcontext.wrap_socket(self.sock, server_hostname=self.key[1], do_handshake_on_connect=False)
+                        self.state = 'handshake'
+                        return self.__handshake()
+                self.state = 'sending'
+                self.__write()
+
+        def __handshake(self):
+                if self.__retryLater(self.sock.do_handshake) is None:
+                        return
+                self.state = 'sending'
+                self.__write()
+
+        def __write(self):
+                while self.__sent < len(self.__out):
+                        sent = self.__retryLater(self.sock.send, buffer(self.__out, self.__sent))
+                        if sent is None:
+                                return
+                        self.__sent += sent
+                self.state = 'reading'
+                self.loop.watch(self.__fd, self.__step, True, False)
+
+        def __read(self):
+                while True:
+                        data = self.__retryLater(self.sock.recv, 65536)
+                        if data is None:
+                                return
+                        if not data:
+                                return self.__closed()
+                        if self.__parse(data):
+                                return self.__complete()
+
+        def __retryLater(self, fn, *args):
+                '''
+                Runs a socket operation, returning None (and watching the socket for when to try again)
+                if it would block, or True for an operation without a result
+                '''
+                try:
+                        result = fn(*args)
+                except ssl.SSLWantReadError:
+                        self.loop.watch(self.__fd, self.__step, True, False)
+                        return None
+                except ssl.SSLWantWriteError:
+                        self.loop.watch(self.__fd, self.__step, False, True)
+                        return None
+                except socket.error, err:
+                        if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                                raise
+                        reading = self.state == 'reading'
+                        self.loop.watch(self.__fd, self.__step, reading, not reading)
+                        return None
+                return True if result is None else result
+
+        def __parse(self, data):
+                '''
+                Adds received data to the response, returning True once the response is complete
+                '''
+                self.__received += len(data)
+                if self.__head is None:
+                        self.__in += data
+                        end = self.__in.find('\r\n\r\n')
+                        if end < 0:
+                                if len(self.__in) > 65536:
+                                        raise httplib.LineTooLong("header")
+                                return False
+                        head, data, self.__in = self.__in[:end], self.__in[end + 4:], ''
+                        self.__head = self.__parseHead(head)
+                        if 100 <= self.__head['status'] < 200:
+                                #An interim response, the real one follows
+                                self.__head = None
+                                return self.__parse(data) if data else False
+                head = self.__head
+                if head['chunked']:
+                        self.__in += data
+                        return self.__parseChunks()
+                self.__body.append(data)
+                self.__bodysize += len(data)
+                return head['length'] is not None and self.__bodysize >= head['length']
+
+        def __parseHead(self, head):
+                lines = head.split('\r\n')
+                parts = lines[0].split(' ', 2)
+                if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+                        raise httplib.BadStatusLine(lines[0])
+                headers = {}
+                for line in lines[1:]:
+                        name, separator, value = line.partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+                length  = headers.get('content-length')
+                length  = int(length) if length is not None and length.isdigit() and not chunked else None
+                connection = headers.get('connection', '').lower()
+                keepalive  = 'keep-alive' in connection if parts[0] == 'HTTP/1.0' else 'close' not in connection
+                return dict(status = int(parts[1]), reason = parts[2] if len(parts) > 2 else '', headers = headers,
+                                chunked = chunked, length = length, keepalive = keepalive and (chunked or length is not None))
+
+        def __parseChunks(self):
+                '''
+                Decodes the chunks received so far, returning True once the last chunk and the trailers have arrived
+                '''
+                while True:
+                        if self.__chunk is None or self.__chunk == 'trailers':
+                                end = self.__in.find('\r\n')
+                                if end < 0:
+                                        return False
+                                line, self.__in = self.__in[:end], self.__in[end + 2:]
+                                if self.__chunk == 'trailers':
+                                        if not line:
+                                                return True
+                                        continue
+                                try:
+                                        size = int(line.split(';')[0].strip(), 16)
+                                except ValueError:
+                                        raise httplib.HTTPException("Malformed chunk size %r" % line)
+                                self.__chunk = size if size else 'trailers'
+                        else:
+                                if len(self.__in) < self.__chunk + 2:
+                                        return False
+                                self.__body.append(self.__in[:self.__chunk])
+                                self.__in    = self.__in[self.__chunk + 2:]
+                                self.__chunk = None
+
+        def __closed(self):
+                '''
+                The server has closed the connection while a response was expected
+                '''
+                if self.__head is not None and self.__head['length'] is None and not self.__head['chunked']:
+                        #The body of this response ends with the connection
+                        return self.__complete()
+                if self.__received == 0:
+                        raise httplib.BadStatusLine("No status line received - the server has closed the connection")
+                raise httplib.IncompleteRead(''.join(self.__body))
+
+        def __complete(self):
+                head = self.__head
+                body = ''.join(self.__body)
+                #Anything after the response leaves the connection out of step
+                extra = self.__in or (head['length'] is not None and len(body) > head['length'])
+                response = dict(status = head['status'], reason = head['reason'], headers = head['headers'],
+                                body = body[:head['length']] if head['length'] is not None else body,
+                                connecttime = self.__connecttime)
+                callback, self.__callback = self.__callback, None
+                if head['keepalive'] and not extra:
+                        self.state     = 'idle'
+                        self.idlesince = time.time()
+                        self.loop.watch(self.__fd, self.__step, True, False)
+                else:
+                        self.close()
+                callback(None, response)
+
+        def __fail(self, error):
+                self.close()
+                callback, self.__callback = self.__callback, None
+                if callback is not None:
+                        callback(error, None)
+
+
+class AsyncSaploJSONClient:
+        """
+         Non-blocking Saplo JSON Client.
+
+         Exposes the same methods as SaploJSONClient, but every call returns a SaploFuture right away. The requests
+         are sent over non-blocking keep-alive connections that a single background thread multiplexes, so one
+         process can keep hundreds of calls in flight without a thread for each. At most `concurrency` requests
+         are in flight at any time, further calls wait in a queue.
+
+         The calls are sent with the session of a SaploJSONClient and follow its settings: expired sessions are
+         renewed and idempotent calls retried with backoff within the client's deadline, and every request is
+         recorded in its metrics. Responses are not cached, request hooks are not run and request bodies are not
+         compressed. Done callbacks of the futures run on the background thread and must not block.
+
+         Example of usage:
+                client  = AsyncSaploJSONClient(apikey, secretkey, concurrency=200)
+                futures = [client.getSimilarArticles(corpusId, articleId, 0, 10, 0.5, 1.0) for articleId in articleIds]
+                for future in futures:
+                        try:
+                                print future.result()['result']
+                        except SaploError, err:
+                                print err.__str__()
+                client.close()
+        """
+        __articlefields = ('headline', 'lead', 'body', 'publishStart', 'publishUrl', 'authors', 'lang')
+
+        def __init__(self, apikey, secretkey, token=None, concurrency=50, client=None, idletimeout=4, sslcontext=None):
+                """
+                @type String
+                @param Saplo API key
+                @type String
+                @param Saplo Secret key
+                @type String
+                @param token - An existing session token to use instead of creating a new session
+                @type Number
+                @param concurrency - The maximum number of requests in flight
+                @type SaploJSONClient
+                @param client - An existing client whose session, settings and metrics should be used instead of a new one's
+                @type Number
+                @param idletimeout - Seconds an idle connection may be kept before it is closed
+                @type ssl.SSLContext
+                @param sslcontext - Context for https connections, one that verifies certificates by default
+                """
+                self.client      = client if client is not None else SaploJSONClient(apikey, secretkey, token)
+                self.concurrency = concurrency
+                self.idletimeout = idletimeout
+                self.sslcontext  = sslcontext
+                self.loop        = SaploEventLoop()
+                self.__lock      = threading.Lock()
+                self.__closed    = False
+                #The state below is only used on the loop thread
+                self.__queue     = collections.deque()
+                self.__idle      = {}
+                self.__inflight  = 0
+                self.__pending   = 0
+                self.__closing   = False
+                self.__sessioning     = False
+                self.__sessionwaiters = []
+
+        def getArticle(self, corpusId, articleId):
+                return self.__submit('corpus.getArticle', (corpusId, articleId))
+
+        def getEntityTags(self, corpusId, articleId, waiton):
+                return self.__submit('tags.getEntityTags', (corpusId, articleId, waiton))
+
+        def getSimilarArticles(self, corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold):
+                return self.__submit('match.getSimilarArticles',
+                                [corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold])
+
+        def createCorpus(self, corpusName, corpusDesc, lang):
+                return self.__submit('corpus.createCorpus', (corpusName, corpusDesc, lang))
+
+        def addArticle(self, corpusId, headline, lead, body, publishStart, publishUrl, authors, lang):
+                return self.__submit('corpus.addArticle', (corpusId, headline, lead, body, publishStart, publishUrl, authors, lang))
+
+        def addArticles(self, corpusId, articles):
+                """
+                Adds many articles, with one addArticle call per article in flight concurrently.
+
+                @rtype SaploFuture
+                @return A future for a list with one response dictionary or SaploError per article, in the given order
+                """
+                futures = []
+                for article in articles:
+                        if isinstance(article, dict):
+                                article = [article.get(field, '') for field in self.__articlefields]
+                        futures.append(self.addArticle(corpusId, *article))
+                combined  = SaploFuture()
+                remaining = [len(futures)]
+                lock      = threading.Lock()
+                def done(future):
+                        with lock:
+                                remaining[0] -= 1
+                                if remaining[0]:
+                                        return
+                        combined.setResult([future.exception() or future.result() for future in futures])
+                for future in futures:
+                        future.addDoneCallback(done)
+                if not futures:
+                        combined.setResult([])
+                return combined
+
+        def getCorpusPermission(self):
+                return self.__submit('corpus.getPermissions', ())
+
+        def getCorpusInfo(self, corpusId):
+                return self.__submit('corpus.getInfo', [corpusId])
+
+        def deleteCorpus(self, corpusId):
+                return self.__submit('corpus.deleteCorpus', [corpusId])
+
+        def createContext(self, contextName, contextDescription):
+                return self.__submit('context.createContext', (contextName, contextDescription))
+
+        def getContexts(self):
+                return self.__submit('context.listContexts', ())
+
+        def deleteContext(self, contextId):
+                return self.__submit('context.deleteContext', [contextId])
+
+        def updateContext(self, contextId, contextName, contextDescription):
+                return self.__submit('context.updateContext', (contextId, contextName, contextDescription))
+
+        def addContextArticles(self, contextId, corpusId, articleIds):
+                #Json-rpc-java compatible list
+                javarpcList = {'javaClass':"java.util.ArrayList",
+                                'list':articleIds}
+                return self.__submit('context.addLikeArticles', [contextId, corpusId, javarpcList])
+
+        def deleteContextArticles(self, contextId, corpusId, articleIds):
+                #Json-rpc-java compatible list
+                javarpcList = {'javaClass':"java.util.ArrayList",
+                                'list':articleIds}
+                return self.__submit('context.deleteLikeArticles', [contextId, corpusId, javarpcList])
+
+        def getContextSimilarity(self, corpusId, articleId, againstContextIds, threshold, limit, wait):
+                #Json-rpc-java compatible list
+                javarpcList = {'javaClass':"java.util.ArrayList",
+                                'list':againstContextIds}
+                return self.__submit('context.getContextSimilarity', [corpusId, articleId, javarpcList, threshold, limit, wait])
+
+        def close(self, wait=True):
+                """
+                Stops the background thread and closes the connections once the outstanding calls have finished.
+                Calls made after close fail with a SaploError.
+
+                @type Bool
+                @param wait - Whether to block until then
+                """
+                with self.__lock:
+                        if not self.__closed:
+                                self.__closed = True
+                                self.loop.callSoon(self.__close)
+                if wait:
+                        self.loop.join()
+
+        def __submit(self, meth, params):
+                future = SaploFuture()
+                deadline = self.client.deadline
+                call = dict(meth = meth, params = params, future = future, attempt = 0, renewed = False,
+                                idempotent = meth in self.client.idempotentmethods,
+                                deadline = time.time() + deadline if deadline is not None else None)
+                with self.__lock:
+                        if self.__closed:
+                                future.setError(SaploError("An error has occured: 'Client closed' With code = ()"))
+                        else:
+                                self.loop.callSoon(self.__start, call)
+                return future
+
+        def __start(self, call):
+                self.__pending += 1
+                self.__queue.append(call)
+                self.__next()
+
+        def __next(self):
+                '''
+                Sends queued calls while there is room for more requests in flight
+                '''
+                while self.__queue and self.__inflight < self.concurrency:
+                        call = self.__queue.popleft()
+                        try:
+                                self.__send(call)
+                        except Exception, err:
+                                self.__resolve(call, error = err)
+
+        def __send(self, call):
+                token = self.client.token
+                if not token:
+                        return self.__needSession(call, None)
+                now = time.time()
+                if call['deadline'] is not None and now >= call['deadline']:
+                        return self.__resolve(call, error = socket.timeout("Deadline exceeded"))
+                body  = self.client.codec.dumps(dict(method = call['meth'], params = call['params'], id = 0))
+                url   = self.client.url.format(token = token)
+                parts = urlparse.urlsplit(url)
+                path  = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+                headers = {'Content-Type': 'application/json'}
+                if self.client.acceptencoding:
+                        headers['Accept-Encoding'] = 'gzip'
+                conn = self.__acquire((parts.scheme, parts.hostname, parts.port))
+                call.update(token = token, url = url, conn = conn, sent = now, timer = None,
+                                info = dict(sent = len(body), received = 0, connect = None, wait = None, decode = None, error = None))
+                if call['deadline'] is not None:
+                        call['timer'] = self.loop.callLater(call['deadline'] - now, conn.abort, socket.timeout("Deadline exceeded"))
+                self.__inflight += 1
+                conn.request(path, headers, body, lambda error, response: self.__done(call, error, response))
+
+        def __done(self, call, error, response):
+                '''
+                Handles the outcome of a request: resolves the call, or sends it again after renewing the session or a backoff
+                '''
+                self.__inflight -= 1
+                self.loop.cancel(call['timer'])
+                conn = call['conn']
+                if conn.state == 'idle':
+                        self.__idle.setdefault(conn.key, []).append(conn)
+                info = call['info']
+                try:
+                        if error is not None:
+                                raise error
+                        result = self.__decode(call, response)
+                except SaploError, err:
+                        info['error'] = err.code
+                        self.client.metrics.record(call['meth'], info)
+                        if not call['renewed'] and self.client.isSessionError(err):
+                                call['renewed'] = True
+                                self.__needSession(call, call['token'])
+                        else:
+                                self.__resolve(call, error = err)
+                except (socket.error, httplib.HTTPException, urllib2.URLError), err:
+                        info['error'] = err
+                        self.client.metrics.record(call['meth'], info)
+                        self.__retryLater(call, err)
+                except Exception, err:
+                        info['error'] = err
+                        self.client.metrics.record(call['meth'], info)
+                        self.__resolve(call, error = err)
+                else:
+                        self.client.metrics.record(call['meth'], info)
+                        self.__resolve(call, result = result)
+                self.__next()
+
+        def __decode(self, call, response):
+                info = call['info']
+                info.update(connect = response['connecttime'], received = len(response['body']),
+                                wait = time.time() - call['sent'] - response['connecttime'])
+                body = response['body']
+                if response['status'] >= 400:
+                        raise urllib2.HTTPError(call['url'], response['status'], response['reason'], response['headers'],
+                                        StringIO.StringIO(body))
+                start = time.time()
+                if response['headers'].get('content-encoding', '').strip().lower() in ('gzip', 'x-gzip'):
+                        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                result = self.client.codec.loads(body)
+                info['decode'] = time.time() - start
+                return self.client.checkResponse(result)
+
+        def __retryLater(self, call, err):
+                '''
+                Queues an idempotent call again after a backoff, like SaploJSONClient retries timeouts and server errors
+                '''
+                client = self.client
+                if (isinstance(err, urllib2.HTTPError) and err.code < 500 and err.code != 429) or \
+                                not call['idempotent'] or call['attempt'] >= client.retries:
+                        return self.__resolve(call, error = err)
+                delay = min(client.maxbackoff, client.backoff * 2 ** call['attempt'])
+                call['attempt'] += 1
+                if call['deadline'] is not None and time.time() + delay > call['deadline']:
+                        return self.__resolve(call, error = err)
+                self.loop.callLater(delay, self.__requeue, [call])
+
+        def __needSession(self, call, expiredtoken):
+                '''
+                Holds a call back until there is a session that is not expiredtoken, creating one on a helper thread
+                '''
+                token = self.client.token
+                if token and token != expiredtoken:
+                        return self.__requeue([call])
+                self.__sessionwaiters.append(call)
+                if self.__sessioning:
+                        return
+                self.__sessioning = True
+                thread = threading.Thread(target=self.__createSession, args=(expiredtoken,))
+                thread.daemon = True
+                thread.start()
+
+        def __createSession(self, expiredtoken):
+                '''
+                Runs on a helper thread, since creating the session blocks
+                '''
+                try:
+                        self.client.session(expiredtoken)
+                except Exception, err:
+                        self.loop.callSoon(self.__sessionDone, err)
+                else:
+                        self.loop.callSoon(self.__sessionDone, None)
+
+        def __sessionDone(self, error):
+                self.__sessioning = False
+                calls, self.__sessionwaiters = self.__sessionwaiters, []
+                if error is None:
+                        return self.__requeue(calls)
+                for call in calls:
+                        self.__resolve(call, error = error)
+
+        def __requeue(self, calls):
+                '''
+                Puts calls that have been sent before at the front of the queue
+                '''
+                self.__queue.extendleft(reversed(calls))
+                self.__next()
+
+        def __resolve(self, call, result=None, error=None):
+                self.__pending -= 1
+                if error is not None:
+                        call['future'].setError(error)
+                else:
+                        call['future'].setResult(result)
+                if self.__closing and not self.__pending:
+                        self.__shutdown()
+
+        def __acquire(self, key):
+                '''
+                Returns an idle connection to key, or a new one
+                '''
+                idle = self.__idle.get(key, [])
+                now  = time.time()
+                while idle:
+                        conn = idle.pop()
+                        if conn.state == 'idle' and now - conn.idlesince <= self.idletimeout:
+                                return conn
+                        conn.close()
+                if key[0] == 'https' and self.sslcontext is None:
+                        self.sslcontext = ssl.create_default_context()
+                return SaploAsyncConnection(self.loop, key, self.sslcontext)
+
+        def __close(self):
+                self.__closing = True
+                if not self.__pending:
+                        self.__shutdown()
+
+        def __shutdown(self):
+                for conns in self.__idle.values():
+                        for conn in conns:
+                                conn.close()
+                self.__idle = {}
+                self.loop.stop()
+
+
+class SaploPoller:
+        """
+        Tracks tag and similarity jobs that are started with wait = 0, as recommended for getEntityTags and getSimilarArticles.
+
+        Jobs are submitted right away and return a SaploFuture. A single background thread then polls every
+        outstanding job, sending all jobs that are due in one batch request, backing off exponentially (with jitter)
+        while a job has no result yet and resolving its future as soon as the result lands.
+
+        Example of usage:
+                poller  = SaploPoller(client)
+                futures = [poller.getEntityTags(corpusId, articleId) for articleId in articleIds]
+                for future in futures:
+                        print future.result()['result']
+                poller.close()
+        """
+        def __init__(self, client, interval=1.0, maxinterval=30.0, timeout=300.0, jitter=0.2, batchsize=100, ispending=None,
+                        maxpolls=5):
+                """
+                @type SaploJSONClient
+                @param client - The client to send requests with
+                @type Float
+                @param interval - Seconds before a job is polled for the first time
+                @type Float
+                @param maxinterval - Upper bound for the time between two polls of the same job
+                @type Float
+                @param timeout - Seconds after which a job that still has no result is given up.
+                        Its future is then resolved with the last response received.
+                @type Float
+                @param jitter - Fraction of each delay that is randomized, to spread out the polls of jobs started together
+                @type Number
+                @param batchsize - Maximum number of jobs polled in one request
+                @type Function
+                @param ispending - ispending(response) returns True while a job has no result yet.
+                        By default an empty result is considered pending. The API gives no completion signal, so an empty
+                        result is ambiguous: it is also the final answer for an article without entities or similar articles.
+                @type Number
+                @param maxpolls - Number of pending responses after which a job is resolved with the last one,
+                        so that jobs whose final result is empty do not wait for the timeout. None for no limit.
+                """
+                self.client      = client
+                self.interval    = interval
+                self.maxinterval = maxinterval
+                self.timeout     = timeout
+                self.jitter      = jitter
+                self.batchsize   = batchsize
+                self.ispending   = ispending if ispending is not None else self.__emptyResult
+                self.maxpolls    = maxpolls
+                self.__jobs      = []
+                self.__sequence  = 0
+                self.__closed    = False
+                self.__condition = threading.Condition()
+                self.__thread    = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        def getEntityTags(self, corpusId, articleId):
+                """
+                Starts tag extraction for an article. Takes the same params as SaploJSONClient.getEntityTags, without waiton.
+
+                @rtype SaploFuture
+                @return A future for the response dictionary that getEntityTags would return
+                """
+                return self.submit('tags.getEntityTags', [corpusId, articleId, 0])
+
+        def getSimilarArticles(self, corpusId, articleId, numberOfResults, minThreshold, maxThreshold):
+                """
+                Starts a similarity search. Takes the same params as SaploJSONClient.getSimilarArticles, without wait.
+
+                @rtype SaploFuture
+                @return A future for the response dictionary that getSimilarArticles would return
+                """
+                return self.submit('match.getSimilarArticles',
+                                [corpusId, articleId, 0, numberOfResults, minThreshold, maxThreshold])
+
+        def getContextSimilarity(self, corpusId, articleId, againstContextIds, threshold, limit):
+                """
+                Starts a context similarity calculation. Takes the same params as SaploJSONClient.getContextSimilarity, without wait.
+
+                @rtype SaploFuture
+                @return A future for the response dictionary that getContextSimilarity would return
+                """
+                #Json-rpc-java compatible list
+                javarpcList = {'javaClass':"java.util.ArrayList",
+                                'list':againstContextIds}
+                return self.submit('context.getContextSimilarity',
+                                [corpusId, articleId, javarpcList, threshold, limit, 0])
+
+        def submit(self, meth, params):
+                """
+                Starts tracking a JSON-RPC call whose params already ask the server not to wait.
+                The call is sent with the next poll round.
+
+                @rtype SaploFuture
+                """
+                future = SaploFuture()
+                now    = time.time()
+                job    = dict(meth = meth, params = params, future = future, delay = self.interval,
+                                deadline = now + self.timeout, polls = 0)
+                self.__schedule(job, now)
+                return future
+
+        def pending(self):
+                """
+                @rtype Number
+                @return The number of jobs that have not been resolved yet
+                """
+                with self.__condition:
+                        return len(self.__jobs)
+
+        def close(self, wait=True):
+                """
+                Stops polling. Jobs that are still outstanding fail with a SaploError.
+                """
+                with self.__condition:
+                        self.__closed = True
+                        self.__condition.notify()
+                if wait:
+                        self.__thread.join()
+
+        def __schedule(self, job, when):
+                with self.__condition:
+                        self.__sequence += 1
+                        heapq.heappush(self.__jobs, (when, self.__sequence, job))
+                        self.__condition.notify()
+
+        def __due(self):
+                """
+                Waits until at least one job is due and takes all due jobs off the schedule
+                """
+                with self.__condition:
+                        while not self.__closed:
+                                now = time.time()
+                                if self.__jobs and self.__jobs[0][0] <= now:
+                                        due = []
+                                        while self.__jobs and self.__jobs[0][0] <= now and len(due) < self.batchsize:
+                                                due.append(heapq.heappop(self.__jobs)[2])
+                                        return due
+                                self.__condition.wait(self.__jobs[0][0] - now if self.__jobs else None)
+                        jobs, self.__jobs = self.__jobs, []
+                for when, sequence, job in jobs:
+                        job['future'].setError(SaploError("An error has occured: 'Poller closed' With code = ()"))
+                return None
+
+        def __run(self):
+                while True:
+                        jobs = self.__due()
+                        if jobs is None:
+                                return
+                        batch = self.client.batch()
+                        for job in jobs:
+                                batch.call(job['meth'], job['params'])
+                        try:
+                                results = batch.execute()
+                        except Exception, err:
+                                results = [err] * len(jobs)
+                        now = time.time()
+                        for job, result in zip(jobs, results):
+                                if isinstance(result, Exception):
+                                        job['future'].setError(result)
+                                        continue
+                                job['polls'] += 1
+                                if (not self.ispending(result) or now >= job['deadline'] or
+                                                (self.maxpolls is not None and job['polls'] >= self.maxpolls)):
+                                        job['future'].setResult(result)
+                                else:
+                                        delay = min(job['delay'], self.maxinterval)
+                                        job['delay'] = delay * 2
+                                        delay = delay * (1 + random.uniform(-self.jitter, self.jitter))
+                                        self.__schedule(job, min(now + delay, job['deadline']))
+
+        def __emptyResult(self, response):
+                return not response.get('result')
@@ -0,0 +1,189 @@
+"""
+Benchmarks SaploJSONClient call patterns against the local mock server.
+
+Reports requests per second, per call latency percentiles and memory use for:
+        single      one new connection per request
+        pooled      requests over kept-alive connections
+        batched     addArticles batches
+        concurrent  calls on a SaploExecutor with several worker threads
+
+Every benchmark runs in a process of its own, with the mock server in another one, so the memory
+use reported for a benchmark is the peak of that benchmark alone. Latencies are measured around
+whole calls in every benchmark.
+
+Example of usage from the commandline:
+        python saplobench.py --requests 2000 --latency 0.005 --workers 16
+"""
+
+import Queue
+import argparse
+import multiprocessing
+import resource
+import time
+import traceback
+
+from saploapi import SaploJSONClient, SaploConnectionPool, SaploExecutor
+from saplomock import SaploMockServer
+
+
+def percentile(samples, fraction):
+        samples = sorted(samples)
+        if not samples:
+                return 0.0
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def report(name, requests, elapsed, latencies):
+        """
+        @rtype Dictionary
+        @return The benchmark result: name, requests, seconds, rps, p50, p95, p99 (milliseconds) and
+                maxrss (kilobytes, the peak of the process running the benchmark)
+        """
+        return dict(name = name, requests = requests, seconds = elapsed, rps = requests / elapsed if elapsed else 0.0,
+                    p50 = 1000 * percentile(latencies, 0.50), p95 = 1000 * percentile(latencies, 0.95),
+                    p99 = 1000 * percentile(latencies, 0.99),
+                    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def timed(call, *args):
+        start = time.time()
+        call(*args)
+        return time.time() - start
+
+
+def article(number):
+        return ("Headline %d" % number, "", "Body text of benchmark article number %d about Saplo" % number, "", "", "", "en")
+
+
+def benchSingle(corpusId, requests):
+        client = SaploJSONClient('key', 'secret', pool=SaploConnectionPool(maxsize=0))
+        start = time.time()
+        latencies = [timed(client.getCorpusInfo, corpusId) for number in range(requests)]
+        return report('single', requests, time.time() - start, latencies)
+
+
+def benchPooled(corpusId, requests):
+        client = SaploJSONClient('key', 'secret')
+        start = time.time()
+        latencies = [timed(client.getCorpusInfo, corpusId) for number in range(requests)]
+        return report('pooled', requests, time.time() - start, latencies)
+
+
+def benchBatched(corpusId, requests, batchsize):
+        client = SaploJSONClient('key', 'secret')
+        articles = [article(number) for number in range(requests)]
+        start = time.time()
+        latencies = [timed(client.addArticles, corpusId, articles[first:first + batchsize], batchsize) / batchsize
+                     for first in range(0, requests, batchsize)]
+        return report('batched', requests, time.time() - start, latencies)
+
+
+def benchConcurrent(corpusId, requests, workers):
+        client = SaploJSONClient('key', 'secret', pool=SaploConnectionPool(maxsize=workers))
+        executor = SaploExecutor(workers)
+        start = time.time()
+        latencies = []
+        for args, result in executor.map(lambda corpusId: timed(client.getCorpusInfo, corpusId), [corpusId] * requests):
+                if isinstance(result, Exception):
+                        raise result
+                latencies.append(result)
+        elapsed = time.time() - start
+        executor.shutdown()
+        return report('concurrent', requests, elapsed, latencies)
+
+
+def serve(latency, urls, stop):
+        """
+        Runs the mock server in its own process until stop is set
+        """
+        try:
+                server = SaploMockServer(latency=latency).start()
+        except Exception:
+                urls.put((False, traceback.format_exc()))
+                return
+        urls.put((True, server.url))
+        stop.wait()
+        server.stop()
+
+
+def isolated(url, bench, args, results):
+        """
+        Runs one benchmark in its own process. A failure is reported with its traceback,
+        since the exception itself may not survive pickling.
+        """
+        SaploJSONClient.url = url
+        try:
+                results.put((True, bench(*args)))
+        except Exception:
+                results.put((False, traceback.format_exc()))
+
+
+def receive(queue, process):
+        """
+        Waits for what a child process puts on a queue.
+
+        @raise RuntimeError if the process failed, or ended without putting anything on the queue
+        """
+        while True:
+                try:
+                        succeeded, value = queue.get(timeout=1)
+                        break
+                except Queue.Empty:
+                        if not process.is_alive():
+                                raise RuntimeError("%s ended with exit code %s" % (process.name, process.exitcode))
+        if not succeeded:
+                raise RuntimeError("%s failed:\n%s" % (process.name, value))
+        return value
+
+
+def run(requests=1000, latency=0.0, workers=8, batchsize=100):
+        """
+        Starts a mock server and runs every benchmark against it, each in a new process.
+
+        @rtype Array
+        @return One result dictionary per benchmark, as returned by report
+        """
+        urls = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, args=(latency, urls, stop))
+        server.start()
+        try:
+                url = receive(urls, server)
+                client = SaploJSONClient('key', 'secret')
+                client.url = url
+                corpusId = client.createCorpus('Benchmark', 'Benchmark corpus', 'en')['result']['corpusId']
+                benchmarks = [(benchSingle, (corpusId, requests)),
+                              (benchPooled, (corpusId, requests)),
+                              (benchBatched, (corpusId, requests, batchsize)),
+                              (benchConcurrent, (corpusId, requests, workers))]
+                results = []
+                for bench, args in benchmarks:
+                        queue = multiprocessing.Queue()
+                        process = multiprocessing.Process(target=isolated, args=(url, bench, args, queue),
+                                                          name=bench.__name__)
+                        process.start()
+                        try:
+                                results.append(receive(queue, process))
+                        finally:
+                                process.join()
+                return results
+        finally:
+                stop.set()
+                server.join()
+
+
+def main():
+        parser = argparse.ArgumentParser(description="Benchmarks SaploJSONClient against a local mock server.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per benchmark")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds the mock server delays every request")
+        parser.add_argument('--workers', type=int, default=8, help="Worker threads for the concurrent benchmark")
+        parser.add_argument('--batchsize', type=int, default=100, help="Articles per batch for the batched benchmark")
+        args = parser.parse_args()
+
+        print "%-12s %10s %10s %10s %10s %10s %12s" % ('benchmark', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'maxrss kB')
+        for result in run(args.requests, args.latency, args.workers, args.batchsize):
+                print "%(name)-12s %(requests)10d %(rps)10.1f %(p50)10.2f %(p95)10.2f %(p99)10.2f %(maxrss)12d" % result
+
+
+if __name__ == "__main__":
+        main()
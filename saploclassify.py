@@ -0,0 +1,139 @@
+"""
+Bulk classification of articles against contexts, and bulk training of contexts.
+
+ContextClassifier sends a stream of articles through getContextSimilarity concurrently, against
+a cached list of all contexts, and yields the best matching context for each article.
+trainContext adds large numbers of "like" articles to a context in bounded chunks.
+
+Example of usage:
+        trainContext(client, sportContextId, corpusId, sportArticleIds)
+
+        classifier = ContextClassifier(client, threshold=0.5, workers=16)
+        for corpusId, articleId, best in classifier.classify((corpusId, articleId) for articleId in newArticleIds):
+                if isinstance(best, Exception):
+                        print articleId, best
+                elif best is not None:
+                        print articleId, classifier.contextName(best.contextId), best.SemanticResultValue
+"""
+
+import time
+
+from saploapi import ContextSimilarity
+
+
+class ContextClassifier:
+        """
+        Classifies articles against all contexts of the user
+        """
+        def __init__(self, client, threshold=0.0, limit=1, wait=30, workers=8, ttl=300, contextIds=None):
+                """
+                @type SaploJSONClient
+                @param client - The client to send the requests with
+                @type Float
+                @param threshold - Minimum similarity for a context to match
+                @type Number
+                @param limit - Number of best contexts the server returns per article
+                @type Number
+                @param wait - Seconds the server may spend on each article (max 120)
+                @type Number
+                @param workers - Number of concurrent requests
+                @type Number
+                @param ttl - Seconds the context list is cached before it is fetched again with getContexts
+                @type Array
+                @param contextIds - Classify against these contexts only, instead of all contexts
+                """
+                self.client     = client
+                self.threshold  = threshold
+                self.limit      = limit
+                self.wait       = wait
+                self.workers    = workers
+                self.ttl        = ttl
+                self.contextIds = contextIds
+                self.__contexts = None
+                self.__fetched  = 0
+
+        def contexts(self):
+                """
+                @rtype Dictionary
+                @return Maps every context id to its context dictionary, as returned by getContexts
+                """
+                if self.__contexts is None or time.time() - self.__fetched > self.ttl:
+                        contexts = self.client.getContexts()['result']
+                        self.__contexts = dict((context['contextId'], context) for context in contexts)
+                        self.__fetched  = time.time()
+                return self.__contexts
+
+        def contextName(self, contextId):
+                context = self.contexts().get(contextId)
+                return context['contextName'] if context else None
+
+        def classify(self, articles, ordered=True):
+                """
+                Classifies a stream of articles.
+
+                @type Iterable
+                @param articles - (corpusId, articleId) tuples, consumed lazily
+                @type Bool
+                @param ordered - Yield in the order of articles if True, as results complete otherwise
+                @rtype Generator
+                @return (corpusId, articleId, best) tuples, where best is the best matching ContextSimilarity,
+                        None if no context reached the threshold, or the SaploError (or other exception) the request
+                        for the article failed with. A failed article does not stop the stream.
+                """
+                for args, result in self.client.map('getContextSimilarity', self.__requests(articles),
+                                workers=self.workers, ordered=ordered):
+                        if isinstance(result, Exception):
+                                yield args[0], args[1], result
+                                continue
+                        matches = [ContextSimilarity(match['contextId'], match['SemanticResultValue'])
+                                   for match in result['result']]
+                        best = max(matches, key=lambda match: match.SemanticResultValue) if matches else None
+                        yield args[0], args[1], best
+
+        def __requests(self, articles):
+                for corpusId, articleId in articles:
+                        contextIds = self.contextIds if self.contextIds is not None else sorted(self.contexts())
+                        yield corpusId, articleId, contextIds, self.threshold, self.limit, self.wait
+
+
+def trainContext(client, contextId, corpusId, articleIds, chunksize=500, workers=4):
+        """
+        Adds many "like" articles to a context, in chunks of at most chunksize ids per addContextArticles request.
+
+        @type SaploJSONClient
+        @param client - The client to send the requests with
+        @type Number
+        @param contextId - The context to train
+        @type Number
+        @param corpusId - The corpus the articles are stored in
+        @type Iterable
+        @param articleIds - The ids of the articles to add, consumed lazily
+        @type Number
+        @param chunksize - Maximum number of article ids per request
+        @type Number
+        @param workers - Number of concurrent requests
+        @rtype Dictionary
+        @return
+                added   Number   Article ids in chunks the server accepted
+                failed  Array    (articleIds, exception) tuples for the chunks that were rejected or could not be sent,
+                                 i.e. a SaploError or an HTTPError once the client has given up retrying. Adding
+                                 articles is not idempotent, so these are left for the caller to resend.
+        """
+        def chunks():
+                chunk = []
+                for articleId in articleIds:
+                        chunk.append(articleId)
+                        if len(chunk) >= chunksize:
+                                yield contextId, corpusId, chunk
+                                chunk = []
+                if chunk:
+                        yield contextId, corpusId, chunk
+
+        stats = dict(added = 0, failed = [])
+        for args, result in client.map('addContextArticles', chunks(), workers=workers):
+                chunk = args[2]
+                if isinstance(result, Exception):
+                        stats['failed'].append((chunk, result))
+                else:
+                        stats['added'] += len(chunk)
+        return stats
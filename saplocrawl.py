@@ -0,0 +1,172 @@
+"""
+Helpers shared by the modules that crawl a corpus article by article and keep the results locally
+(saploindex, saplograph and saploexport).
+
+ArticleCrawl fetches the articles added since the last crawl together with the articles that failed
+in earlier crawls. The rest of the module reads and writes the memory-mapped files and the JSON
+manifests the crawled results are stored in.
+
+Example of usage:
+        crawl = ArticleCrawl(manifest['failed'])
+        args  = lambda articleId: (corpusId, articleId, wait)
+        for articleId, result in crawl.run(client, client.getEntityTags, args, first, last, workers=16):
+                if result is not None:
+                        store(articleId, result['result'])
+        writeManifest(path, manifest)
+"""
+
+import array
+import itertools
+import json
+import os
+import sys
+
+from saploapi import SaploExecutor, SaploError
+
+
+class ArticleCrawl:
+        """
+        Fetches a range of articles concurrently and keeps track of the articles that have to be fetched again.
+
+        Deleted articles leave gaps in the article ids, they are skipped. An article that fails with any other
+        SaploError is recorded in failed and fetched again by the next crawl. The server answers with an empty
+        result both when an article has nothing to report and when it has not finished the article within wait,
+        so an empty result is recorded the same way and only accepted once it has come back emptyattempts crawls in a row.
+        """
+        def __init__(self, failed=None, emptyattempts=3):
+                """
+                @type Dictionary
+                @param failed - The articles that failed in earlier crawls, article id to [error, attempts]. Updated in place.
+                @type Number
+                @param emptyattempts - Number of crawls an article has to come back empty before that is accepted
+                """
+                self.failed        = failed if failed is not None else {}
+                self.emptyattempts = emptyattempts
+
+        def run(self, client, fn, args, first, last, workers=8, empty=None):
+                """
+                Calls fn for the articles that failed before and then for the articles first to last.
+
+                @type SaploJSONClient
+                @param client - The client fn sends its requests with, to tell deleted articles from failed ones
+                @type Function
+                @param fn - Fetches one article, called as fn(*args(articleId))
+                @type Function
+                @param args - Gives the arguments of fn for an article id
+                @type Number
+                @param first - The first new article id
+                @type Number
+                @param last - The last new article id
+                @type Number
+                @param workers - Number of concurrent calls
+                @type Function
+                @param empty - empty(result) gives the error to record if a result may only be empty because the server has not
+                        finished the article, None if the result is final. By default an empty 'result' list is recorded.
+                @rtype Generator
+                @return (articleId, result) for every article in the order they were fetched, where result is None for deleted
+                        articles and for articles that were recorded in failed. Exceptions other than SaploError are raised.
+                """
+                empty    = empty or self.__emptyResult
+                ids      = itertools.chain(sorted(self.failed), xrange(first, last + 1))
+                executor = SaploExecutor(workers)
+                try:
+                        for (articleId,), result in executor.map(lambda articleId: fn(*args(articleId)), ids):
+                                yield articleId, self.__outcome(client, articleId, result, empty)
+                finally:
+                        executor.shutdown(False)
+
+        def fail(self, articleId, error):
+                """
+                Records a failed fetch of an article.
+
+                @rtype Number
+                @return The number of crawls in a row the article has failed in with this error
+                """
+                previous, attempts = self.failed.get(articleId, (None, 0))
+                attempts = attempts + 1 if previous == error else 1
+                self.failed[articleId] = [error, attempts]
+                return attempts
+
+        def failures(self):
+                """
+                @rtype Array
+                @return (articleId, error, attempts) tuples for the articles that will be fetched again, in ascending order
+                """
+                return sorted((articleId, error, attempts) for articleId, (error, attempts) in self.failed.items())
+
+        def __outcome(self, client, articleId, result, empty):
+                if isinstance(result, SaploError) and client.isNotFoundError(result):
+                        #Deleted articles leave gaps in the article ids
+                        self.failed.pop(articleId, None)
+                        return None
+                if isinstance(result, SaploError):
+                        self.fail(articleId, result.value)
+                        return None
+                if isinstance(result, Exception):
+                        raise result
+                error = empty(result)
+                if error is not None and self.fail(articleId, error) < self.emptyattempts:
+                        return None
+                self.failed.pop(articleId, None)
+                return result
+
+        def __emptyResult(self, result):
+                return None if result['result'] else 'Empty result'
+
+
+def readArray(data, typecode, offset, count):
+        """
+        Reads little-endian values from a string or memory map.
+
+        @rtype array.array
+        @return count values of the array typecode, starting at offset
+        """
+        values = array.array(typecode)
+        values.fromstring(data[offset:offset + values.itemsize * count])
+        if sys.byteorder == 'big':
+                values.byteswap()
+        return values
+
+
+def writeArrays(out, arrays):
+        """
+        Writes arrays to a file in little-endian byte order, one after the other.
+        """
+        for values in arrays:
+                if sys.byteorder == 'big':
+                        values = array.array(values.typecode, values)
+                        values.byteswap()
+                values.tofile(out)
+
+
+def replaceFile(path, write):
+        """
+        Writes a file under a temporary name with write(file) and then renames it into place,
+        so an interrupted write never leaves a partial file behind.
+        """
+        with open(path + '.tmp', 'wb') as out:
+                write(out)
+        os.rename(path + '.tmp', path)
+
+
+def readManifest(path, defaults):
+        """
+        Reads a JSON manifest.
+
+        @type Dictionary
+        @param defaults - The manifest to start from if there is none yet, also filling in keys missing from older manifests
+        @rtype Dictionary
+        @return The manifest, with the article ids of its failed articles as numbers
+        """
+        manifest = dict(defaults)
+        if os.path.exists(path):
+                with open(path) as existing:
+                        manifest.update(json.load(existing))
+        if 'failed' in manifest:
+                #JSON object keys are strings
+                manifest['failed'] = dict((int(articleId), value) for articleId, value in manifest['failed'].items())
+        return manifest
+
+
+def writeManifest(path, manifest):
+        replaceFile(path, lambda out: json.dump(manifest, out))
@@ -0,0 +1,439 @@
+"""
+Corpus snapshots: exports the articles, entity tags and similar articles of a corpus to local files.
+
+A snapshot lives in a directory of chunk files. Each chunk holds the articles of one page of article
+ids in columns (article ids, offsets into the other columns, tag ids, tag types, tag words, match
+ids, similar article ids and values, and the article metadata as JSON), which are memory-mapped for reading, so
+a snapshot can be analysed without the API. A manifest records the chunks, the last article id
+that has been exported and the articles that could not be fetched, so an interrupted export resumes
+after the last complete chunk, and a later export only fetches the articles added since and the ones
+that failed before. Those are merged into the chunk covering their article id.
+
+Example of usage:
+        snapshot = CorpusSnapshot('snapshots/corpus-1234')
+        snapshot.export(client, 1234, workers=16, similar=True)
+        print snapshot.article(42)['headline']
+        print collections.Counter(snapshot.column('tagTypeIds'))
+
+Or from the commandline:
+        python saploexport.py --apikey KEY --secretkey SECRET --similar 1234 snapshots/corpus-1234
+"""
+
+import argparse
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+
+from saploapi import SaploJSONClient, SaploError, Tag, SimilarArticle
+from saplocrawl import ArticleCrawl, readArray, writeArrays, replaceFile, readManifest, writeManifest
+
+MAGIC = 'SPX1'
+#magic, articles, tags, edges, metadata bytes, tag word bytes
+HEADER = struct.Struct('<4s5I')
+
+#The per-tag and per-edge columns of a chunk, in file order, with their array typecodes
+COLUMNS = (('tagIds', 'i'), ('tagTypeIds', 'i'), ('wordOffsets', 'i'),
+           ('matchIds', 'i'), ('resultCorpusIds', 'i'), ('resultArticleIds', 'i'), ('resultValues', 'f'))
+
+
+class SnapshotChunk:
+        """
+        One memory-mapped chunk file of a CorpusSnapshot
+        """
+        def __init__(self, path):
+                self.path = path
+                self.file = open(path, 'rb')
+                self.map  = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, self.narticles, self.ntags, self.nedges, metasize, wordsize = HEADER.unpack_from(self.map, 0)
+                if magic != MAGIC:
+                        raise ValueError("%s is not a corpus snapshot chunk" % path)
+                offset = HEADER.size
+                self.articleIds  = readArray(self.map, 'i', offset, self.narticles)
+                self.metaOffsets = readArray(self.map, 'i', offset + 4 * self.narticles, self.narticles + 1)
+                self.tagOffsets  = readArray(self.map, 'i', offset + 4 * (2 * self.narticles + 1), self.narticles + 1)
+                self.edgeOffsets = readArray(self.map, 'i', offset + 4 * (3 * self.narticles + 2), self.narticles + 1)
+                offset += 4 * (4 * self.narticles + 3)
+                #The remaining columns are only read when needed
+                self.columnsat = {}
+                for name, typecode in COLUMNS:
+                        self.columnsat[name] = offset
+                        offset += 4 * self.__length(name)
+                self.metaat  = offset
+                self.wordsat = offset + metasize
+
+        def article(self, articleId):
+                """
+                @rtype Dictionary
+                @return The article as returned by getArticle, or None if the chunk does not hold it
+                """
+                index = self.__index(articleId)
+                if index is None:
+                        return None
+                first, last = self.metaOffsets[index], self.metaOffsets[index + 1]
+                return json.loads(self.map[self.metaat + first:self.metaat + last])
+
+        def tags(self, articleId):
+                """
+                @rtype Array
+                @return Tag tuples for the article
+                """
+                index = self.__index(articleId)
+                if index is None:
+                        return []
+                first, last = self.tagOffsets[index], self.tagOffsets[index + 1]
+                count   = last - first
+                tagIds  = self.__unpack('tagIds', 'i', first, count)
+                types   = self.__unpack('tagTypeIds', 'i', first, count)
+                offsets = self.__unpack('wordOffsets', 'i', first, count + 1)
+                words   = [self.map[self.wordsat + start:self.wordsat + end].decode('utf-8')
+                           for start, end in zip(offsets, offsets[1:])]
+                return [Tag(tagId, word, tagTypeId) for tagId, word, tagTypeId in zip(tagIds, words, types)]
+
+        def similar(self, articleId):
+                """
+                @rtype Array
+                @return SimilarArticle tuples for the article, most similar first. Values are stored as 32 bit floats.
+                """
+                index = self.__index(articleId)
+                if index is None:
+                        return []
+                first, last = self.edgeOffsets[index], self.edgeOffsets[index + 1]
+                count   = last - first
+                matches = self.__unpack('matchIds', 'i', first, count)
+                corpora = self.__unpack('resultCorpusIds', 'i', first, count)
+                targets = self.__unpack('resultArticleIds', 'i', first, count)
+                values  = self.__unpack('resultValues', 'f', first, count)
+                return [SimilarArticle(*match) for match in zip(matches, corpora, targets, values)]
+
+        def column(self, name):
+                """
+                @type String
+                @param name - One of tagIds, tagTypeIds, wordOffsets, matchIds, resultCorpusIds, resultArticleIds or resultValues
+                @rtype array.array
+                @return The whole column, in the order of the articles
+                """
+                return readArray(self.map, dict(COLUMNS)[name], self.columnsat[name], self.__length(name))
+
+        def __iter__(self):
+                return iter(self.articleIds)
+
+        def close(self):
+                self.map.close()
+                self.file.close()
+
+        def __index(self, articleId):
+                index = bisect.bisect_left(self.articleIds, articleId)
+                if index >= self.narticles or self.articleIds[index] != articleId:
+                        return None
+                return index
+
+        def __length(self, name):
+                """
+                The number of values in a column
+                """
+                if name == 'wordOffsets':
+                        return self.ntags + 1
+                return self.ntags if name.startswith('tag') else self.nedges
+
+        def __unpack(self, name, typecode, first, count):
+                return struct.unpack_from('<%d%s' % (count, typecode), self.map, self.columnsat[name] + 4 * first)
+
+
+def writeChunk(path, articles):
+        """
+        Writes articles to a chunk file.
+
+        @type String
+        @param path - The chunk file
+        @type Array
+        @param articles - (articleId, article, tags, similar) tuples in ascending articleId order, with the
+                results of getArticle, getEntityTags and getSimilarArticles
+        """
+        articleIds  = array.array('i')
+        metaOffsets = array.array('i', [0])
+        tagOffsets  = array.array('i', [0])
+        edgeOffsets = array.array('i', [0])
+        columns     = dict((name, array.array(typecode)) for name, typecode in COLUMNS)
+        columns['wordOffsets'].append(0)
+        meta  = []
+        words = []
+        for articleId, article, tags, similar in articles:
+                articleIds.append(articleId)
+                meta.append(json.dumps(article, separators=(',', ':')))
+                metaOffsets.append(metaOffsets[-1] + len(meta[-1]))
+                for tag in tags:
+                        word = tag['tagWord']
+                        words.append(word.encode('utf-8') if isinstance(word, unicode) else word)
+                        columns['tagIds'].append(tag['tagId'])
+                        columns['tagTypeIds'].append(tag['tagTypeId'])
+                        columns['wordOffsets'].append(columns['wordOffsets'][-1] + len(words[-1]))
+                tagOffsets.append(len(columns['tagIds']))
+                for match in similar:
+                        columns['matchIds'].append(match['matchId'])
+                        columns['resultCorpusIds'].append(match['resultCorpusId'])
+                        columns['resultArticleIds'].append(match['resultArticleId'])
+                        columns['resultValues'].append(match['resultValue'])
+                edgeOffsets.append(len(columns['resultArticleIds']))
+
+        header  = HEADER.pack(MAGIC, len(articleIds), len(columns['tagIds']), len(columns['resultArticleIds']),
+                              metaOffsets[-1], columns['wordOffsets'][-1])
+        ordered = [articleIds, metaOffsets, tagOffsets, edgeOffsets] + [columns[name] for name, typecode in COLUMNS]
+        def write(chunk):
+                chunk.write(header)
+                writeArrays(chunk, ordered)
+                chunk.write(''.join(meta))
+                chunk.write(''.join(words))
+        replaceFile(path, write)
+
+
+class CorpusSnapshot:
+        """
+        Snapshot of one corpus, stored in a directory
+        """
+        def __init__(self, path):
+                """
+                @type String
+                @param path - The directory the snapshot is stored in, created if it does not exist
+                """
+                self.path = path
+                if not os.path.isdir(path):
+                        os.makedirs(path)
+                self.manifest = readManifest(self.__manifestPath(),
+                                             dict(corpusId = None, lastArticleId = 0, tags = None, similar = None, chunks = [],
+                                                  nextChunk = 1, failed = {}))
+                self.chunks = [SnapshotChunk(os.path.join(path, name)) for name in self.manifest['chunks']]
+                #The first article id of every chunk, ascending since chunks are exported in article id order
+                self.starts = [chunk.articleIds[0] for chunk in self.chunks]
+
+        def export(self, client, corpusId, workers=8, wait=30, tags=True, similar=False, numberOfResults=50,
+                        minThreshold=0.0, maxThreshold=1.0, chunksize=10000, emptyattempts=3):
+                """
+                Fetches every article added to the corpus since the last export, with its tags and similar articles, and stores them.
+
+                Articles that could not be fetched, or came back without tags or similar articles fewer than emptyattempts
+                exports in a row, are recorded in failed() and fetched again by the next export (see ArticleCrawl).
+
+                @type SaploJSONClient
+                @param client - The client to send the requests with
+                @type Number
+                @param corpusId - The corpus to export. A snapshot only holds one corpus.
+                @type Number
+                @param workers - Number of articles fetched concurrently
+                @type Number
+                @param wait - Seconds the server may spend extracting the tags or similar articles of each article
+                @type Bool
+                @param tags - Export the entity tags of every article
+                @type Bool
+                @param similar - Export the similar articles of every article
+                @type Number
+                @param numberOfResults - Maximum number of similar articles per article (at most 50)
+                @type Float
+                @param minThreshold - Minimum similarity for a similar article
+                @type Float
+                @param maxThreshold - Maximum similarity for a similar article
+                @type Number
+                @param chunksize - Number of article ids per chunk. Progress is recorded after every chunk.
+                @type Number
+                @param emptyattempts - Number of exports an article has to come back without tags or similar articles before that is accepted
+                @rtype Number
+                @return The number of articles exported
+                @raise Exceptions other than SaploError, i.e. when the server cannot be reached. The export resumes after
+                        the last complete chunk when it is run again.
+                """
+                if self.manifest['corpusId'] not in (None, corpusId):
+                        raise ValueError("The snapshot in %s belongs to corpus %s" % (self.path, self.manifest['corpusId']))
+                if self.manifest['corpusId'] is not None and (self.manifest['tags'], self.manifest['similar']) != (tags, similar):
+                        raise ValueError("The snapshot in %s was exported with tags=%s and similar=%s" %
+                                         (self.path, self.manifest['tags'], self.manifest['similar']))
+                self.manifest.update(corpusId = corpusId, tags = tags, similar = similar)
+                first = self.manifest['lastArticleId'] + 1
+                last  = client.getCorpusInfo(corpusId)['result']['lastArticleId']
+                retry = bool(self.manifest['failed'])
+                crawl = ArticleCrawl(self.manifest['failed'], emptyattempts)
+
+                def fetch(articleId):
+                        article     = client.getArticle(corpusId, articleId)['result']
+                        articletags = client.getEntityTags(corpusId, articleId, wait)['result'] if tags else []
+                        matches     = client.getSimilarArticles(corpusId, articleId, wait, numberOfResults,
+                                                                minThreshold, maxThreshold)['result'] if similar else []
+                        return articleId, article, articletags, matches
+
+                def empty(result):
+                        if tags and not result[2]:
+                                return 'No tags'
+                        if similar and not result[3]:
+                                return 'No similar articles'
+                        return None
+
+                articles = []
+                retried  = []
+                exported = 0
+                for articleId, result in crawl.run(client, fetch, lambda articleId: (articleId,), first, last, workers, empty):
+                        if articleId < first:
+                                if result is not None:
+                                        retried.append(result)
+                                continue
+                        if retried:
+                                exported += self.__mergeChunks(retried)
+                                retried = []
+                        if result is not None:
+                                articles.append(result)
+                        if (articleId - first + 1) % chunksize == 0:
+                                self.__addChunk(articles, articleId)
+                                exported += len(articles)
+                                articles = []
+                if retried:
+                        exported += self.__mergeChunks(retried)
+                if last >= first or retry:
+                        self.__addChunk(articles, max(last, first - 1))
+                        exported += len(articles)
+                return exported
+
+        def failed(self):
+                """
+                @rtype Array
+                @return (articleId, error, attempts) tuples for the articles that will be fetched again by the next export
+                """
+                return ArticleCrawl(self.manifest['failed']).failures()
+
+        def article(self, articleId):
+                """
+                @rtype Dictionary
+                @return The article as returned by getArticle, or None if the snapshot does not hold it
+                """
+                chunk = self.__chunk(articleId)
+                return chunk.article(articleId) if chunk else None
+
+        def tags(self, articleId):
+                """
+                @rtype Array
+                @return Tag tuples for the article
+                """
+                chunk = self.__chunk(articleId)
+                return chunk.tags(articleId) if chunk else []
+
+        def similar(self, articleId):
+                """
+                @rtype Array
+                @return SimilarArticle tuples for the article, most similar first
+                """
+                chunk = self.__chunk(articleId)
+                return chunk.similar(articleId) if chunk else []
+
+        def column(self, name):
+                """
+                Gives a column of every chunk, i.e. for counting tag types. See SnapshotChunk.column.
+
+                @rtype array.array
+                """
+                values = array.array(dict(COLUMNS)[name])
+                for chunk in self.chunks:
+                        values.extend(chunk.column(name))
+                return values
+
+        def __iter__(self):
+                """
+                Yields the ids of the articles in the snapshot, in ascending order
+                """
+                for chunk in self.chunks:
+                        for articleId in chunk:
+                                yield articleId
+
+        def __len__(self):
+                return sum(chunk.narticles for chunk in self.chunks)
+
+        def close(self):
+                for chunk in self.chunks:
+                        chunk.close()
+                self.chunks = []
+                self.starts = []
+
+        def __chunk(self, articleId):
+                index = bisect.bisect_right(self.starts, articleId) - 1
+                return self.chunks[index] if index >= 0 else None
+
+        def __addChunk(self, articles, lastArticleId):
+                """
+                Writes a chunk and records it, together with the export progress, in the manifest
+                """
+                if articles:
+                        name = 'chunk-%06d.bin' % self.manifest['nextChunk']
+                        self.manifest['nextChunk'] += 1
+                        writeChunk(os.path.join(self.path, name), articles)
+                        self.manifest['chunks'].append(name)
+                        self.chunks.append(SnapshotChunk(os.path.join(self.path, name)))
+                        self.starts.append(self.chunks[-1].articleIds[0])
+                self.manifest['lastArticleId'] = lastArticleId
+                writeManifest(self.__manifestPath(), self.manifest)
+
+        def __mergeChunks(self, articles):
+                """
+                Adds articles that failed in an earlier export to the chunks covering their ids, by writing those chunks anew,
+                so the chunks stay in ascending article id order
+
+                @rtype Number
+                @return The number of articles added
+                """
+                if not self.chunks:
+                        self.__addChunk(sorted(articles), self.manifest['lastArticleId'])
+                        return len(articles)
+                added = {}
+                for item in articles:
+                        added.setdefault(max(bisect.bisect_right(self.starts, item[0]) - 1, 0), []).append(item)
+                old = []
+                for index, items in added.items():
+                        chunk = self.chunks[index]
+                        items.extend((articleId, chunk.article(articleId), [tag._asdict() for tag in chunk.tags(articleId)],
+                                      [match._asdict() for match in chunk.similar(articleId)]) for articleId in chunk)
+                        items.sort(key=lambda item: item[0])
+                        name = 'chunk-%06d.bin' % self.manifest['nextChunk']
+                        self.manifest['nextChunk'] += 1
+                        writeChunk(os.path.join(self.path, name), items)
+                        self.manifest['chunks'][index] = name
+                        self.chunks[index] = SnapshotChunk(os.path.join(self.path, name))
+                        self.starts[index] = self.chunks[index].articleIds[0]
+                        old.append(chunk)
+                writeManifest(self.__manifestPath(), self.manifest)
+                for chunk in old:
+                        chunk.close()
+                        os.remove(chunk.path)
+                return len(articles)
+
+        def __manifestPath(self):
+                return os.path.join(self.path, 'manifest.json')
+
+
+def main():
+        parser = argparse.ArgumentParser(description="Exports a Saplo corpus to a local snapshot, or updates an existing snapshot.")
+        parser.add_argument('corpusId', type=int, help="The corpus to export")
+        parser.add_argument('directory', help="The snapshot directory")
+        parser.add_argument('--apikey', required=True)
+        parser.add_argument('--secretkey', required=True)
+        parser.add_argument('--workers', type=int, default=8, help="Number of articles fetched concurrently")
+        parser.add_argument('--wait', type=int, default=30, help="Seconds the server may spend per article")
+        parser.add_argument('--notags', action='store_true', help="Do not export entity tags")
+        parser.add_argument('--similar', action='store_true', help="Export similar articles")
+        parser.add_argument('--results', type=int, default=50, help="Maximum number of similar articles per article")
+        parser.add_argument('--threshold', type=float, default=0.0, help="Minimum similarity for a similar article")
+        parser.add_argument('--chunksize', type=int, default=10000, help="Article ids per chunk")
+        args = parser.parse_args()
+
+        try:
+                client = SaploJSONClient(args.apikey, args.secretkey)
+                snapshot = CorpusSnapshot(args.directory)
+                exported = snapshot.export(client, args.corpusId, args.workers, args.wait, not args.notags, args.similar,
+                                           args.results, args.threshold, chunksize = args.chunksize)
+        except SaploError, err:
+                print >> sys.stderr, err.__str__()
+                sys.exit(1)
+
+        print >> sys.stderr, "Exported %d articles, the snapshot holds %d, %d will be fetched again by the next export" % (
+                exported, len(snapshot), len(snapshot.failed()))
+
+
+if __name__ == "__main__":
+        main()
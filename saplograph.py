@@ -0,0 +1,238 @@
+"""
+Corpus-wide article similarity graph, crawled from getSimilarArticles and stored locally.
+
+The graph lives in a directory of segment files. Each segment holds the edges found in one crawl
+as flat arrays (sorted source ids, offsets into the edge arrays, target ids and similarity values),
+which are memory-mapped for lookups. A manifest records the segments, the last article id
+that has been crawled and the articles that could not be queried, so a refresh only queries the
+articles added since the previous run and the ones that failed in it.
+
+Example of usage:
+        graph = SimilarityGraph('graphs/corpus-1234')
+        graph.refresh(client, 1234, workers=16)
+        for articleId, value in graph.neighbours(42, k=5):
+                print articleId, value
+"""
+
+import array
+import bisect
+import mmap
+import os
+import struct
+
+from saplocrawl import ArticleCrawl, readArray, writeArrays, replaceFile, readManifest, writeManifest
+
+MAGIC = 'SPG1'
+HEADER = struct.Struct('<4sII')
+
+
+class SimilarityGraphSegment:
+        """
+        One memory-mapped segment file of a SimilarityGraph
+        """
+        def __init__(self, path):
+                self.path = path
+                self.file = open(path, 'rb')
+                self.map  = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, self.nsources, self.nedges = HEADER.unpack_from(self.map, 0)
+                if magic != MAGIC:
+                        raise ValueError("%s is not a similarity graph segment" % path)
+                self.sources = readArray(self.map, 'i', HEADER.size, self.nsources)
+                self.offsets = readArray(self.map, 'i', HEADER.size + 4 * self.nsources, self.nsources + 1)
+                self.targetsat = HEADER.size + 4 * (2 * self.nsources + 1)
+                self.valuesat  = self.targetsat + 4 * self.nedges
+
+        def edges(self, articleId):
+                """
+                @rtype Array
+                @return (targetArticleId, value) tuples for the edges from articleId in this segment
+                """
+                index = bisect.bisect_left(self.sources, articleId)
+                if index >= self.nsources or self.sources[index] != articleId:
+                        return []
+                first, last = self.offsets[index], self.offsets[index + 1]
+                count   = last - first
+                targets = struct.unpack_from('<%di' % count, self.map, self.targetsat + 4 * first)
+                values  = struct.unpack_from('<%df' % count, self.map, self.valuesat + 4 * first)
+                return zip(targets, values)
+
+        def __iter__(self):
+                """
+                Yields (sourceArticleId, targetArticleId, value) for every edge in the segment
+                """
+                for index, source in enumerate(self.sources):
+                        for target, value in self.edges(source):
+                                yield source, target, value
+
+        def close(self):
+                self.map.close()
+                self.file.close()
+
+
+def writeSegment(path, edges):
+        """
+        Writes edges to a segment file.
+
+        @type String
+        @param path - The segment file
+        @type Dictionary
+        @param edges - Maps a source article id to a dictionary of target article id to similarity value
+        """
+        sources = array.array('i', sorted(edges))
+        offsets = array.array('i', [0])
+        targets = array.array('i')
+        values  = array.array('f')
+        for source in sources:
+                for target, value in sorted(edges[source].items()):
+                        targets.append(target)
+                        values.append(value)
+                offsets.append(len(targets))
+        def write(segment):
+                segment.write(HEADER.pack(MAGIC, len(sources), len(targets)))
+                writeArrays(segment, (sources, offsets, targets, values))
+        replaceFile(path, write)
+
+
+class SimilarityGraph:
+        """
+        Article similarity graph for one corpus, stored in a directory
+        """
+        def __init__(self, path):
+                """
+                @type String
+                @param path - The directory the graph is stored in, created if it does not exist
+                """
+                self.path = path
+                if not os.path.isdir(path):
+                        os.makedirs(path)
+                self.manifest = readManifest(self.__manifestPath(),
+                                             dict(corpusId = None, lastArticleId = 0, segments = [], nextSegment = 1, failed = {}))
+                self.segments = [SimilarityGraphSegment(os.path.join(path, name)) for name in self.manifest['segments']]
+
+        def refresh(self, client, corpusId, workers=8, wait=30, numberOfResults=50, minThreshold=0.0, maxThreshold=1.0,
+                        symmetric=True, segmentsize=10000, emptyattempts=3):
+                """
+                Queries getSimilarArticles for every article added to the corpus since the last refresh and stores the edges.
+
+                Articles that could not be queried, or came back without similar articles fewer than emptyattempts
+                refreshes in a row, are recorded in failed() and queried again by the next refresh (see ArticleCrawl).
+
+                @type SaploJSONClient
+                @param client - The client to send the requests with
+                @type Number
+                @param corpusId - The corpus to crawl. A graph only holds one corpus.
+                @type Number
+                @param workers - Number of concurrent requests
+                @type Number
+                @param wait - Seconds the server may spend calculating each result
+                @type Number
+                @param numberOfResults - Maximum number of similar articles requested per article (at most 50)
+                @type Float
+                @param minThreshold - Minimum similarity for an edge
+                @type Float
+                @param maxThreshold - Maximum similarity for an edge
+                @type Bool
+                @param symmetric - Also store every edge in the reverse direction, so older articles gain newer neighbours
+                @type Number
+                @param segmentsize - Number of crawled articles after which the edges are written out and progress recorded
+                @type Number
+                @param emptyattempts - Number of refreshes an article has to come back without similar articles before that is accepted
+                @rtype Number
+                @return The number of articles crawled
+                """
+                if self.manifest['corpusId'] not in (None, corpusId):
+                        raise ValueError("The graph in %s belongs to corpus %s" % (self.path, self.manifest['corpusId']))
+                self.manifest['corpusId'] = corpusId
+                first = self.manifest['lastArticleId'] + 1
+                last  = client.getCorpusInfo(corpusId)['result']['lastArticleId']
+                retry = bool(self.manifest['failed'])
+                crawl = ArticleCrawl(self.manifest['failed'], emptyattempts)
+                args  = lambda articleId: (corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold)
+                empty = lambda result: None if result['result'] else 'No similar articles'
+
+                edges   = {}
+                crawled = 0
+                for articleId, result in crawl.run(client, client.getSimilarArticles, args, first, last, workers, empty):
+                        if result is not None:
+                                for match in result['result']:
+                                        if match['resultCorpusId'] != corpusId:
+                                                continue
+                                        self.__addEdge(edges, articleId, match['resultArticleId'], match['resultValue'])
+                                        if symmetric:
+                                                self.__addEdge(edges, match['resultArticleId'], articleId, match['resultValue'])
+                        crawled += 1
+                        if crawled % segmentsize == 0:
+                                self.__addSegment(edges, max(articleId, first - 1))
+                                edges = {}
+                if last >= first or retry:
+                        self.__addSegment(edges, max(last, first - 1))
+                return crawled
+
+        def failed(self):
+                """
+                @rtype Array
+                @return (articleId, error, attempts) tuples for the articles that will be queried again by the next refresh
+                """
+                return ArticleCrawl(self.manifest['failed']).failures()
+
+        def neighbours(self, articleId, k=10):
+                """
+                Gives the most similar articles from the local graph.
+
+                @type Number
+                @param articleId - The source article
+                @type Number
+                @param k - How many neighbours to return
+                @rtype Array
+                @return (articleId, value) tuples, most similar first
+                """
+                best = {}
+                for segment in self.segments:
+                        for target, value in segment.edges(articleId):
+                                if value > best.get(target, -1.0):
+                                        best[target] = value
+                return sorted(best.items(), key=lambda edge: (-edge[1], edge[0]))[:k]
+
+        def compact(self):
+                """
+                Merges all segments into one, keeping the highest value for duplicate edges
+                """
+                if len(self.segments) < 2:
+                        return
+                edges = {}
+                for segment in self.segments:
+                        for source, target, value in segment:
+                                self.__addEdge(edges, source, target, value)
+                old = self.segments
+                self.segments = []
+                self.manifest['segments'] = []
+                self.__addSegment(edges, self.manifest['lastArticleId'])
+                for segment in old:
+                        segment.close()
+                        os.remove(segment.path)
+
+        def close(self):
+                for segment in self.segments:
+                        segment.close()
+                self.segments = []
+
+        def __addEdge(self, edges, source, target, value):
+                targets = edges.setdefault(source, {})
+                if value > targets.get(target, -1.0):
+                        targets[target] = value
+
+        def __addSegment(self, edges, lastArticleId):
+                """
+                Writes a segment and records it, together with the crawl progress, in the manifest
+                """
+                if edges:
+                        name = 'segment-%06d.bin' % self.manifest['nextSegment']
+                        self.manifest['nextSegment'] += 1
+                        writeSegment(os.path.join(self.path, name), edges)
+                        self.manifest['segments'].append(name)
+                        self.segments.append(SimilarityGraphSegment(os.path.join(self.path, name)))
+                self.manifest['lastArticleId'] = lastArticleId
+                writeManifest(self.__manifestPath(), self.manifest)
+
+        def __manifestPath(self):
+                return os.path.join(self.path, 'manifest.json')
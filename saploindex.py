@@ -0,0 +1,221 @@
+"""
+Local inverted index over the entity tags of a corpus.
+
+Harvests getEntityTags for every article with concurrent requests and stores, in a sqlite file,
+which articles mention each (tagTypeId, normalized tagWord) entity and how often entities are
+mentioned in the same article. Later harvests only fetch the articles added since the last one
+and the articles whose tags could not be fetched before, and questions like "which articles
+mention organisation X" are answered without the API.
+
+Example of usage:
+        index = EntityIndex('corpus-1234.entities')
+        index.harvest(client, 1234, workers=16)
+        print index.articles(ORGANISATION, 'Paramount')
+        print index.cooccurring(ORGANISATION, 'Paramount')
+"""
+
+import re
+import sqlite3
+
+from saplocrawl import ArticleCrawl
+
+#Tag types, as returned in tagTypeId
+PERSON       = 3
+ORGANISATION = 4
+GEONAME      = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS entities (
+        entityId  INTEGER PRIMARY KEY,
+        tagTypeId INTEGER NOT NULL,
+        word      TEXT NOT NULL,
+        tagWord   TEXT NOT NULL,
+        UNIQUE (tagTypeId, word));
+CREATE TABLE IF NOT EXISTS postings (
+        entityId  INTEGER NOT NULL,
+        articleId INTEGER NOT NULL,
+        PRIMARY KEY (entityId, articleId)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postingsByArticle ON postings (articleId);
+CREATE TABLE IF NOT EXISTS cooccurrences (
+        entityId  INTEGER NOT NULL,
+        otherId   INTEGER NOT NULL,
+        articles  INTEGER NOT NULL,
+        PRIMARY KEY (entityId, otherId)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS failed (
+        articleId INTEGER PRIMARY KEY,
+        error     TEXT NOT NULL,
+        attempts  INTEGER NOT NULL);
+"""
+
+
+def normalize(word):
+        """
+        Normalizes a tag word for lookups: lower case with single spaces between words
+        """
+        return re.sub(r'\s+', ' ', word, flags=re.UNICODE).strip().lower()
+
+
+class EntityIndex:
+        """
+        Persistent inverted index from entities to the articles of one corpus that mention them
+        """
+        def __init__(self, path):
+                """
+                @type String
+                @param path - The sqlite database file, created if it does not exist
+                """
+                self.path = path
+                self.db   = sqlite3.connect(path)
+                self.db.executescript(SCHEMA)
+                self.db.commit()
+
+        def harvest(self, client, corpusId, workers=8, wait=30, commitevery=1000, emptyattempts=3):
+                """
+                Fetches the entity tags of every article added to the corpus since the last harvest and indexes them.
+
+                Articles whose tags could not be fetched, or came back without tags fewer than emptyattempts harvests
+                in a row, are recorded in failed() and fetched again by the next harvest (see ArticleCrawl).
+
+                @type SaploJSONClient
+                @param client - The client to send the requests with
+                @type Number
+                @param corpusId - The corpus to index. An index only holds one corpus.
+                @type Number
+                @param workers - Number of concurrent requests
+                @type Number
+                @param wait - Seconds the server may spend extracting the tags of each article
+                @type Number
+                @param commitevery - Number of articles after which the index and the harvest progress are committed
+                @type Number
+                @param emptyattempts - Number of harvests an article has to come back without tags before that is accepted
+                @rtype Number
+                @return The number of articles harvested
+                """
+                indexed = self.meta('corpusId')
+                if indexed not in (None, corpusId):
+                        raise ValueError("The index in %s belongs to corpus %s" % (self.path, indexed))
+                self.setMeta('corpusId', corpusId)
+                first = (self.meta('lastArticleId') or 0) + 1
+                last  = client.getCorpusInfo(corpusId)['result']['lastArticleId']
+                crawl = ArticleCrawl(dict((articleId, [error, attempts]) for articleId, error, attempts in self.failed()),
+                                     emptyattempts)
+                args  = lambda articleId: (corpusId, articleId, wait)
+                empty = lambda result: None if result['result'] else 'No tags'
+
+                harvested = 0
+                try:
+                        for articleId, result in crawl.run(client, client.getEntityTags, args, first, last, workers, empty):
+                                if result is not None:
+                                        self.add(articleId, result['result'])
+                                harvested += 1
+                                if harvested % commitevery == 0:
+                                        if articleId >= first:
+                                                self.setMeta('lastArticleId', articleId)
+                                        self.__commit(crawl)
+                except Exception:
+                        self.db.rollback()
+                        raise
+                if last >= first:
+                        self.setMeta('lastArticleId', last)
+                self.__commit(crawl)
+                return harvested
+
+        def add(self, articleId, tags):
+                """
+                Indexes the tags of one article. The caller commits.
+
+                @type Number
+                @param articleId - The article the tags belong to
+                @type Array
+                @param tags - Tag dictionaries as returned by getEntityTags
+                """
+                entityIds = set()
+                for tag in tags:
+                        word = normalize(tag['tagWord'])
+                        self.db.execute("INSERT OR IGNORE INTO entities (tagTypeId, word, tagWord) VALUES (?, ?, ?)",
+                                        (tag['tagTypeId'], word, tag['tagWord']))
+                        entityIds.add(self.db.execute("SELECT entityId FROM entities WHERE tagTypeId = ? AND word = ?",
+                                        (tag['tagTypeId'], word)).fetchone()[0])
+                new = [entityId for entityId in entityIds if self.db.execute(
+                                "INSERT OR IGNORE INTO postings VALUES (?, ?)", (entityId, articleId)).rowcount]
+                #Only pairs involving an entity new to this article change the co-occurrence counts
+                pairs = set((entityId, otherId) for entityId in new for otherId in entityIds if otherId != entityId)
+                pairs |= set((otherId, entityId) for entityId, otherId in pairs)
+                for entityId, otherId in pairs:
+                        self.db.execute("INSERT OR IGNORE INTO cooccurrences VALUES (?, ?, 0)", (entityId, otherId))
+                        self.db.execute("UPDATE cooccurrences SET articles = articles + 1 WHERE entityId = ? AND otherId = ?",
+                                        (entityId, otherId))
+
+        def failed(self):
+                """
+                @rtype Array
+                @return (articleId, error, attempts) tuples for the articles that will be fetched again by the next harvest
+                """
+                return self.db.execute("SELECT articleId, error, attempts FROM failed ORDER BY articleId").fetchall()
+
+        def articles(self, tagTypeId, tagWord):
+                """
+                @type Number
+                @param tagTypeId - PERSON, ORGANISATION or GEONAME
+                @type String
+                @param tagWord - The entity, matched case and whitespace insensitively
+                @rtype Array
+                @return The ids of the articles that mention the entity, in ascending order
+                """
+                return [row[0] for row in self.db.execute(
+                                "SELECT articleId FROM postings JOIN entities USING (entityId) "
+                                "WHERE tagTypeId = ? AND word = ? ORDER BY articleId",
+                                (tagTypeId, normalize(tagWord)))]
+
+        def entities(self, articleId):
+                """
+                @rtype Array
+                @return (tagTypeId, tagWord) tuples for the entities mentioned in an article
+                """
+                return self.db.execute("SELECT tagTypeId, tagWord FROM entities JOIN postings USING (entityId) "
+                                "WHERE articleId = ? ORDER BY tagTypeId, word", (articleId,)).fetchall()
+
+        def cooccurring(self, tagTypeId, tagWord, limit=10, otherTypeId=None):
+                """
+                Gives the entities most often mentioned in the same articles as an entity.
+
+                @type Number
+                @param tagTypeId - The type of the entity
+                @type String
+                @param tagWord - The entity, matched case and whitespace insensitively
+                @type Number
+                @param limit - Maximum number of entities returned
+                @type Number
+                @param otherTypeId - Only return entities of this type, all types if None
+                @rtype Array
+                @return (tagTypeId, tagWord, articles) tuples, the most frequent first
+                """
+                query = ("SELECT other.tagTypeId, other.tagWord, cooccurrences.articles FROM entities "
+                         "JOIN cooccurrences USING (entityId) JOIN entities AS other ON other.entityId = cooccurrences.otherId "
+                         "WHERE entities.tagTypeId = ? AND entities.word = ?")
+                params = [tagTypeId, normalize(tagWord)]
+                if otherTypeId is not None:
+                        query += " AND other.tagTypeId = ?"
+                        params.append(otherTypeId)
+                query += " ORDER BY cooccurrences.articles DESC, other.word LIMIT ?"
+                params.append(limit)
+                return self.db.execute(query, params).fetchall()
+
+        def meta(self, key):
+                row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                return row[0] if row else None
+
+        def setMeta(self, key, value):
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+        def close(self):
+                self.db.close()
+
+        def __commit(self, crawl):
+                """
+                Commits the index together with the articles the harvest has to fetch again
+                """
+                self.db.execute("DELETE FROM failed")
+                self.db.executemany("INSERT INTO failed VALUES (?, ?, ?)", crawl.failures())
+                self.db.commit()
@@ -0,0 +1,223 @@
+"""
+Streaming bulk ingestion of articles from JSONL or CSV dumps into a Saplo corpus.
+
+Articles are read lazily, sent in concurrent batches with a bounded number of batches in flight,
+and a "source key, corpusId, articleId" line is written for every stored article as soon as its batch completes.
+A checkpoint file records how many source records are done, so an interrupted run can be restarted where it stopped.
+
+Example of usage from the commandline:
+        python saploingest.py --apikey KEY --secretkey SECRET 1234 articles.jsonl --output ids.tsv --checkpoint ids.checkpoint
+"""
+
+import argparse
+import collections
+import csv
+import datetime
+import functools
+import itertools
+import json
+import os
+import sys
+
+from saploapi import SaploJSONClient, SaploError, SaploExecutor
+from saplojournal import SaploJournal
+
+#Formats that publish dates are accepted in, they are all sent as YYYY-MM-DD HH:MM:SS
+DATEFORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M',
+               '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d', '%a, %d %b %Y %H:%M:%S')
+
+ARTICLEFIELDS = ('headline', 'lead', 'body', 'publishStart', 'publishUrl', 'authors', 'lang')
+
+
+def readArticles(path, format=None, keyfield='id'):
+        """
+        Reads articles one at a time from a JSONL or CSV file.
+
+        @type String
+        @param path - The file to read, '-' reads from stdin
+        @type String
+        @param format - 'jsonl' or 'csv', guessed from the file extension if None
+        @type String
+        @param keyfield - The field that identifies an article in the source, the record number is used if it is missing
+        @rtype Generator
+        @return (key, article) tuples, where article is a dictionary with the addArticle field names
+        """
+        if format is None:
+                format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        source = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+                if format == 'csv':
+                        records = (dict((field, value.decode('utf-8')) for field, value in row.items() if value is not None)
+                                   for row in csv.DictReader(source))
+                else:
+                        records = (json.loads(line) for line in source if line.strip())
+                for number, record in enumerate(records):
+                        key = record.get(keyfield)
+                        yield (number if key is None else key), record
+        finally:
+                if source is not sys.stdin:
+                        source.close()
+
+
+def normalizeDate(value):
+        """
+        Converts a publish date to the YYYY-MM-DD HH:MM:SS format that addArticle expects.
+
+        @param value - A date string in one of DATEFORMATS, a unix timestamp, a datetime or an empty value
+        @rtype String
+        @return The formatted date, or '' for an empty value
+        @raise ValueError if the date can not be understood
+        """
+        if value in (None, ''):
+                return ''
+        if isinstance(value, datetime.datetime):
+                return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, (int, long, float)):
+                return datetime.datetime.utcfromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+        value = value.strip()
+        for dateformat in DATEFORMATS:
+                try:
+                        return datetime.datetime.strptime(value, dateformat).strftime('%Y-%m-%d %H:%M:%S')
+                except ValueError:
+                        pass
+        raise ValueError("Unknown publish date format: %r" % value)
+
+
+def ingest(client, corpusId, articles, out, checkpoint=None, workers=4, batchsize=50, lang='en', journal=None):
+        """
+        Adds a stream of articles to a corpus.
+
+        @type SaploJSONClient
+        @param client - The client to send the articles with
+        @type Number
+        @param corpusId - The corpus to add the articles to
+        @type Iterable
+        @param articles - (key, article) tuples as returned by readArticles
+        @type File
+        @param out - Stream that a tab separated "key, corpusId, articleId" line is written to for every stored article
+        @type String
+        @param checkpoint - File recording how many records are done. If it exists, that many records are skipped.
+        @type Number
+        @param workers - Number of batches sent concurrently
+        @type Number
+        @param batchsize - Number of articles per batch request
+        @type String
+        @param lang - Language for articles that do not specify one
+        @type SaploJournal
+        @param journal - Journal of stored articles. Articles it already knows are not uploaded again.
+        @rtype Dictionary
+        @return
+                stored     Number   Articles stored in this run
+                journaled  Number   Stored articles that the journal already knew, and were not uploaded
+                failed     Number   Articles that the server or the date normalization rejected
+                skipped    Number   Records skipped because the checkpoint says they are done
+        """
+        done = readCheckpoint(checkpoint)
+        stats = dict(stored = 0, failed = 0, skipped = done, journaled = 0)
+        articles = itertools.islice(articles, done, None)
+
+        #Batches are yielded back in the order they are sent, so the chunks can be matched up from a queue
+        chunks = collections.deque()
+        def batches():
+                while True:
+                        chunk = prepare(itertools.islice(articles, batchsize), lang, stats)
+                        if not chunk:
+                                return
+                        chunks.append(chunk)
+                        yield corpusId, [article for key, article in chunk if article is not None]
+
+        send = client.addArticles if journal is None else functools.partial(journal.addArticles, client)
+        executor = SaploExecutor(workers)
+        try:
+                for args, results in executor.map(send, batches(), maxinflight=2 * workers):
+                        chunk = chunks.popleft()
+                        if isinstance(results, Exception):
+                                #The whole batch failed, stop so the checkpoint stays in front of it
+                                raise results
+                        stored = [key for key, article in chunk if article is not None]
+                        for key, result in zip(stored, results):
+                                if isinstance(result, SaploError):
+                                        stats['failed'] += 1
+                                        sys.stderr.write("Could not add article %s: %s\n" % (key, result))
+                                        continue
+                                line = u"%s\t%s\t%s\n" % (key, result['result']['corpusId'], result['result']['articleId'])
+                                out.write(line.encode('utf-8'))
+                                stats['stored'] += 1
+                                stats['journaled'] += 1 if result['result'].get('journaled') else 0
+                        out.flush()
+                        done += len(chunk)
+                        writeCheckpoint(checkpoint, done)
+        finally:
+                executor.shutdown(False)
+        return stats
+
+
+def prepare(articles, lang, stats):
+        """
+        Turns (key, record) tuples into (key, article) tuples with the addArticle fields, normalizing the publish date.
+        Records whose date can not be normalized get None as article, and are counted as failed and reported on stderr.
+        """
+        prepared = []
+        for key, record in articles:
+                try:
+                        publishStart = normalizeDate(record.get('publishStart', record.get('publishDate')))
+                except ValueError, err:
+                        stats['failed'] += 1
+                        sys.stderr.write("Could not add article %s: %s\n" % (key, err))
+                        prepared.append((key, None))
+                        continue
+                article = dict((field, record.get(field) or '') for field in ARTICLEFIELDS)
+                article['publishStart'] = publishStart
+                article['lang'] = article['lang'] or lang
+                prepared.append((key, article))
+        return prepared
+
+
+def readCheckpoint(path):
+        if path is None or not os.path.exists(path):
+                return 0
+        with open(path) as checkpoint:
+                return json.load(checkpoint)['records']
+
+
+def writeCheckpoint(path, records):
+        if path is None:
+                return
+        #Write a new file and rename it over the old one, so a crash never leaves a half written checkpoint
+        with open(path + '.tmp', 'w') as checkpoint:
+                json.dump(dict(records = records), checkpoint)
+        os.rename(path + '.tmp', path)
+
+
+def main():
+        parser = argparse.ArgumentParser(description="Adds the articles in a JSONL or CSV file to a Saplo corpus.")
+        parser.add_argument('corpusId', type=int, help="The corpus to add the articles to")
+        parser.add_argument('input', help="The JSONL or CSV file with articles, '-' for stdin")
+        parser.add_argument('--apikey', required=True)
+        parser.add_argument('--secretkey', required=True)
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help="Input format, guessed from the extension by default")
+        parser.add_argument('--keyfield', default='id', help="The field that identifies an article in the input")
+        parser.add_argument('--output', help="File to append the key, corpusId and articleId mappings to (default stdout)")
+        parser.add_argument('--checkpoint', help="Checkpoint file to resume from and to record progress in")
+        parser.add_argument('--workers', type=int, default=4, help="Number of batches sent concurrently")
+        parser.add_argument('--batchsize', type=int, default=50, help="Number of articles per batch request")
+        parser.add_argument('--lang', default='en', help="Language for articles that do not specify one")
+        parser.add_argument('--journal', help="Journal file of stored articles, known articles are not uploaded again")
+        args = parser.parse_args()
+
+        try:
+                client = SaploJSONClient(args.apikey, args.secretkey)
+                out = open(args.output, 'a') if args.output else sys.stdout
+                articles = readArticles(args.input, args.format, args.keyfield)
+                journal = SaploJournal(args.journal) if args.journal else None
+                stats = ingest(client, args.corpusId, articles, out, args.checkpoint,
+                               args.workers, args.batchsize, args.lang, journal)
+        except SaploError, err:
+                print >> sys.stderr, err.__str__()
+                sys.exit(1)
+
+        print >> sys.stderr, "Stored {stored} articles ({journaled} known from the journal), {failed} failed, {skipped} skipped from checkpoint".format(**stats)
+
+
+if __name__ == "__main__":
+        main()
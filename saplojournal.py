@@ -0,0 +1,174 @@
+"""
+Local write-ahead journal of the articles stored in each corpus, to skip re-uploading duplicates.
+
+The server identifies an article by its headline, body and publishUrl, and returns the existing id
+when the same article is added again, but only after the whole body has been uploaded. The journal
+keeps a content hash of those fields for every article stored in a corpus, together with the
+returned articleId, so that known articles are answered locally without a request.
+
+Every article is written to the journal before it is sent and completed when the server answers,
+in a sqlite file in WAL mode, so the journal survives crashes and restarts and can be shared by
+several processes.
+
+Example of usage:
+        journal = SaploJournal('articles.journal')
+        response = journal.addArticle(client, corpusId, headline, lead, body, publishDate, url, authors, 'en')
+        print response['result']['articleId']
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+        corpusId    INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        articleId   INTEGER,
+        stored      REAL NOT NULL,
+        PRIMARY KEY (corpusId, fingerprint));
+"""
+
+
+def fingerprint(headline, body, publishUrl):
+        """
+        Gives the content hash identifying an article, from the fields the server deduplicates on
+        """
+        digest = hashlib.sha1()
+        for field in (headline, body, publishUrl):
+                field = field or u''
+                digest.update(field.encode('utf-8') if isinstance(field, unicode) else field)
+                digest.update('\0')
+        return digest.hexdigest()
+
+
+class SaploJournal:
+        """
+        Persistent record of which articles have been stored in which corpus. Safe to share between threads.
+        """
+        def __init__(self, path):
+                """
+                @type String
+                @param path - The sqlite database file, created if it does not exist
+                """
+                self.path   = path
+                self.__lock = threading.Lock()
+                self.__db   = sqlite3.connect(path, check_same_thread=False)
+                self.__db.execute("PRAGMA journal_mode=WAL")
+                self.__db.executescript(SCHEMA)
+                self.__db.commit()
+
+        def lookup(self, corpusId, articlefingerprint):
+                """
+                @rtype Number
+                @return The articleId of a stored article, or None if the article is unknown or its upload never completed
+                """
+                with self.__lock:
+                        row = self.__db.execute("SELECT articleId FROM articles WHERE corpusId = ? AND fingerprint = ?",
+                                        (corpusId, articlefingerprint)).fetchone()
+                return row[0] if row else None
+
+        def begin(self, corpusId, articlefingerprints):
+                """
+                Records that articles are about to be sent
+                """
+                with self.__lock:
+                        self.__db.executemany("INSERT OR IGNORE INTO articles VALUES (?, ?, NULL, ?)",
+                                        [(corpusId, articlefingerprint, time.time()) for articlefingerprint in articlefingerprints])
+                        self.__db.commit()
+
+        def complete(self, corpusId, stored):
+                """
+                Records the articleIds the server returned
+
+                @type Array
+                @param stored - (fingerprint, articleId) tuples
+                """
+                with self.__lock:
+                        self.__db.executemany("UPDATE articles SET articleId = ?, stored = ? WHERE corpusId = ? AND fingerprint = ?",
+                                        [(articleId, time.time(), corpusId, articlefingerprint) for articlefingerprint, articleId in stored])
+                        self.__db.commit()
+
+        def addArticle(self, client, corpusId, headline, lead, body, publishStart, publishUrl, authors, lang):
+                """
+                Adds an article with client.addArticle, unless the journal already knows it.
+                Takes the same params as SaploJSONClient.addArticle after the client.
+
+                @rtype dictionary
+                @return The addArticle response. For a known article it is created locally and result has journaled = True.
+                """
+                return self.addArticles(client, corpusId, [(headline, lead, body, publishStart, publishUrl, authors, lang)])[0]
+
+        def addArticles(self, client, corpusId, articles, batchsize=100):
+                """
+                Adds the articles the journal does not know with client.addArticles.
+                Takes the same params as SaploJSONClient.addArticles after the client.
+
+                @rtype Array
+                @return One response dictionary or SaploError per article, in the given order.
+                        Responses for known articles are created locally and their result has journaled = True.
+                """
+                articles = [article if not isinstance(article, dict) else
+                            tuple(article.get(field, '') for field in ('headline', 'lead', 'body', 'publishStart',
+                                                                       'publishUrl', 'authors', 'lang'))
+                            for article in articles]
+                fingerprints = [fingerprint(article[0], article[2], article[4]) for article in articles]
+                results = [None] * len(articles)
+                unknown = []
+                for index, articlefingerprint in enumerate(fingerprints):
+                        articleId = self.lookup(corpusId, articlefingerprint)
+                        if articleId is None:
+                                unknown.append(index)
+                        else:
+                                results[index] = dict(id = 0, result = dict(corpusId = corpusId, articleId = articleId, journaled = True))
+                if not unknown:
+                        return results
+
+                self.begin(corpusId, [fingerprints[index] for index in unknown])
+                responses = client.addArticles(corpusId, [articles[index] for index in unknown], batchsize)
+                stored = []
+                for index, response in zip(unknown, responses):
+                        results[index] = response
+                        if isinstance(response, dict):
+                                stored.append((fingerprints[index], response['result']['articleId']))
+                self.complete(corpusId, stored)
+                return results
+
+        def forgetCorpus(self, corpusId):
+                """
+                Drops the journal entries of a corpus, i.e. after it has been deleted
+                """
+                with self.__lock:
+                        self.__db.execute("DELETE FROM articles WHERE corpusId = ?", (corpusId,))
+                        self.__db.commit()
+
+        def compact(self, corpusIds=None, pendingage=86400):
+                """
+                Removes stale entries and shrinks the journal file.
+
+                @type Array
+                @param corpusIds - The corpora that still exist (i.e. from getCorpusPermission). Entries for other corpora are removed.
+                        Nothing is removed for this reason if None.
+                @type Float
+                @param pendingage - Seconds after which an upload that never completed is forgotten, so the article is sent again
+                @rtype Number
+                @return The number of entries removed
+                """
+                with self.__lock:
+                        removed = self.__db.execute("DELETE FROM articles WHERE articleId IS NULL AND stored < ?",
+                                        (time.time() - pendingage,)).rowcount
+                        if corpusIds is not None:
+                                known = set(corpusIds)
+                                for (corpusId,) in self.__db.execute("SELECT DISTINCT corpusId FROM articles").fetchall():
+                                        if corpusId not in known:
+                                                removed += self.__db.execute("DELETE FROM articles WHERE corpusId = ?",
+                                                                (corpusId,)).rowcount
+                        self.__db.commit()
+                        self.__db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                        self.__db.execute("VACUUM")
+                return removed
+
+        def close(self):
+                with self.__lock:
+                        self.__db.close()
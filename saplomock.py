@@ -0,0 +1,452 @@
+"""
+Local stand-in for the Saplo JSON-RPC API, for testing and benchmarking clients without api.saplo.com.
+
+Implements the methods SaploJSONClient calls, keeping corpora, articles and contexts in memory.
+Tags and similarities are computed with simple word statistics, so results are deterministic but
+not meaningful. Latency, JSON-RPC errors, HTTP errors and expiring sessions can be injected.
+
+Example of usage:
+        server = SaploMockServer(latency=0.01)
+        server.start()
+        SaploJSONClient.url = server.url
+        client = SaploJSONClient('key', 'secret')
+        ...
+        server.stop()
+
+Or from the commandline, to serve until interrupted:
+        python saplomock.py --port 8080 --latency 0.02
+"""
+
+import argparse
+import BaseHTTPServer
+import itertools
+import json
+import random
+import re
+import socket
+import SocketServer
+import threading
+import time
+import urlparse
+import uuid
+import zlib
+
+#Error codes returned by the mock server
+ERROR_UNKNOWN_METHOD = 404
+ERROR_INVALID_PARAMS = 400
+ERROR_NOT_FOUND      = 410
+ERROR_INJECTED       = 500
+ERROR_SESSION        = 595
+
+
+class SaploMockError(Exception):
+        """
+        Raised by the mock API methods, turned into a JSON-RPC error response
+        """
+        def __init__(self, value, code):
+                self.value = value
+                self.code  = code
+        def __str__(self):
+                return repr(self.value)
+
+
+class SaploMockAPI:
+        """
+        In-memory implementation of the Saplo API methods. Thread safe.
+        """
+        def __init__(self, apikey=None, secretkey=None, pendingpolls=0, sessionlifetime=None):
+                """
+                @type String
+                @param apikey - Only accept this api key, any key is accepted if None
+                @type String
+                @param secretkey - Only accept this secret key, any key is accepted if None
+                @type Number
+                @param pendingpolls - How many times a tag or similarity request with wait = 0 returns an empty
+                        result before the result is ready, to exercise result polling
+                @type Float
+                @param sessionlifetime - Seconds before a session expires, None for sessions that never expire
+                """
+                self.apikey          = apikey
+                self.secretkey       = secretkey
+                self.pendingpolls    = pendingpolls
+                self.sessionlifetime = sessionlifetime
+                self.sessions        = {}
+                self.corpora         = {}
+                self.contexts        = {}
+                self.polls           = {}
+                self.lock            = threading.RLock()
+                self.corpusids       = itertools.count(1)
+                self.contextids      = itertools.count(1)
+                self.methods = {
+                        'auth.createSession':           self.createSession,
+                        'corpus.createCorpus':          self.createCorpus,
+                        'corpus.addArticle':            self.addArticle,
+                        'corpus.getArticle':            self.getArticle,
+                        'corpus.getInfo':               self.getInfo,
+                        'corpus.getPermissions':        self.getPermissions,
+                        'corpus.deleteCorpus':          self.deleteCorpus,
+                        'tags.getEntityTags':           self.getEntityTags,
+                        'match.getSimilarArticles':     self.getSimilarArticles,
+                        'context.createContext':        self.createContext,
+                        'context.listContexts':         self.listContexts,
+                        'context.updateContext':        self.updateContext,
+                        'context.deleteContext':        self.deleteContext,
+                        'context.addLikeArticles':      self.addLikeArticles,
+                        'context.deleteLikeArticles':   self.deleteLikeArticles,
+                        'context.getContextSimilarity': self.getContextSimilarity,
+                        }
+
+        def call(self, token, meth, params):
+                """
+                Runs a JSON-RPC method for the session token and returns its result
+                """
+                method = self.methods.get(meth)
+                if method is None:
+                        raise SaploMockError("Unknown method %s" % meth, ERROR_UNKNOWN_METHOD)
+                with self.lock:
+                        if meth != 'auth.createSession':
+                                self.checkSession(token)
+                        try:
+                                return method(*params)
+                        except TypeError, err:
+                                raise SaploMockError(str(err), ERROR_INVALID_PARAMS)
+
+        def checkSession(self, token):
+                created = self.sessions.get(token)
+                if created is None or (self.sessionlifetime is not None and time.time() - created > self.sessionlifetime):
+                        self.sessions.pop(token, None)
+                        raise SaploMockError("Invalid session", ERROR_SESSION)
+
+        def expireSessions(self):
+                with self.lock:
+                        self.sessions.clear()
+
+        def createSession(self, apikey, secretkey):
+                if (self.apikey is not None and apikey != self.apikey) or (self.secretkey is not None and secretkey != self.secretkey):
+                        raise SaploMockError("Invalid api key or secret key", ERROR_SESSION)
+                token = uuid.uuid4().hex
+                self.sessions[token] = time.time()
+                return token
+
+        def createCorpus(self, corpusName, corpusDesc, lang):
+                corpusId = next(self.corpusids)
+                self.corpora[corpusId] = dict(corpusName = corpusName, corpusDesc = corpusDesc, lang = lang,
+                                articles = {}, fingerprints = {}, words = {})
+                return dict(corpusId = corpusId)
+
+        def addArticle(self, corpusId, headline, lead, body, publishStart, publishUrl, authors, lang):
+                corpus = self.corpus(corpusId)
+                fingerprint = (headline, body, publishUrl)
+                articleId = corpus['fingerprints'].get(fingerprint)
+                if articleId is None:
+                        articleId = len(corpus['articles']) + 1
+                        corpus['fingerprints'][fingerprint] = articleId
+                        corpus['articles'][articleId] = dict(headline = headline, publishUrl = publishUrl,
+                                        text = u' '.join((headline or '', lead or '', body or '')))
+                        corpus['words'][articleId] = words(corpus['articles'][articleId]['text'])
+                return dict(corpusId = corpusId, articleId = articleId)
+
+        def getArticle(self, corpusId, articleId):
+                article = self.article(corpusId, articleId)
+                return dict(corpusId = corpusId, articleId = articleId, headline = article['headline'],
+                                publishUrl = article['publishUrl'])
+
+        def getInfo(self, corpusId):
+                corpus = self.corpus(corpusId)
+                return dict(corpusId = corpusId, corpusName = corpus['corpusName'], corpusDesc = corpus['corpusDesc'],
+                                lang = corpus['lang'], lastArticleId = len(corpus['articles']))
+
+        def getPermissions(self):
+                return [dict(corpusId = corpusId, permission = 'write') for corpusId in sorted(self.corpora)]
+
+        def deleteCorpus(self, corpusId):
+                self.corpus(corpusId)
+                del self.corpora[corpusId]
+                return True
+
+        def getEntityTags(self, corpusId, articleId, waiton):
+                article = self.article(corpusId, articleId)
+                if self.pending(('tags', corpusId, articleId), waiton):
+                        return []
+                tags = []
+                for word in sorted(set(re.findall(r'\b[A-Z][a-z]+(?:\s[A-Z][a-z]+)*', article['text']))):
+                        tags.append(dict(tagId = len(tags) + 1, tagWord = word, tagTypeId = 3 + len(word) % 3))
+                return tags
+
+        def getSimilarArticles(self, corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold):
+                self.article(corpusId, articleId)
+                if self.pending(('match', corpusId, articleId), wait):
+                        return []
+                corpus = self.corpus(corpusId)
+                source = corpus['words'][articleId]
+                matches = []
+                for otherId, other in corpus['words'].items():
+                        if otherId == articleId:
+                                continue
+                        value = similarity(source, other)
+                        if minThreshold <= value <= maxThreshold:
+                                matches.append((value, otherId))
+                matches.sort(reverse = True)
+                return [dict(matchId = matchId, resultCorpusId = corpusId, resultArticleId = otherId, resultValue = round(value, 4))
+                                for matchId, (value, otherId) in enumerate(matches[:min(numberOfResults, 50)], 1)]
+
+        def createContext(self, contextName, contextDescription):
+                contextId = next(self.contextids)
+                self.contexts[contextId] = dict(contextName = contextName, contextDescription = contextDescription, articles = set())
+                return dict(contextId = contextId)
+
+        def listContexts(self):
+                return [dict(contextId = contextId, contextName = context['contextName'],
+                                contextDescription = context['contextDescription'])
+                                for contextId, context in sorted(self.contexts.items())]
+
+        def updateContext(self, contextId, contextName, contextDescription):
+                self.context(contextId).update(contextName = contextName, contextDescription = contextDescription)
+                return True
+
+        def deleteContext(self, contextId):
+                self.context(contextId)
+                del self.contexts[contextId]
+                return True
+
+        def addLikeArticles(self, contextId, corpusId, articleIds):
+                context = self.context(contextId)
+                for articleId in javaList(articleIds):
+                        self.article(corpusId, articleId)
+                        context['articles'].add((corpusId, articleId))
+                return True
+
+        def deleteLikeArticles(self, contextId, corpusId, articleIds):
+                context = self.context(contextId)
+                for articleId in javaList(articleIds):
+                        context['articles'].discard((corpusId, articleId))
+                return True
+
+        def getContextSimilarity(self, corpusId, articleId, againstContextIds, threshold, limit, wait):
+                self.article(corpusId, articleId)
+                if self.pending(('context', corpusId, articleId), wait):
+                        return []
+                source = self.corpus(corpusId)['words'][articleId]
+                results = []
+                for contextId in javaList(againstContextIds):
+                        context = self.context(contextId)
+                        contextwords = set()
+                        for likeCorpusId, likeArticleId in context['articles']:
+                                if likeCorpusId in self.corpora:
+                                        contextwords |= self.corpora[likeCorpusId]['words'].get(likeArticleId, set())
+                        value = similarity(source, contextwords)
+                        if value >= threshold:
+                                results.append(dict(contextId = contextId, SemanticResultValue = round(value, 4)))
+                results.sort(key = lambda result: result['SemanticResultValue'], reverse = True)
+                return results[:limit]
+
+        def pending(self, job, wait):
+                """
+                Whether a job asked for without waiting should still look unfinished
+                """
+                if wait:
+                        return False
+                polls = self.polls.get(job, 0)
+                if polls >= self.pendingpolls:
+                        return False
+                self.polls[job] = polls + 1
+                return True
+
+        def corpus(self, corpusId):
+                corpus = self.corpora.get(corpusId)
+                if corpus is None:
+                        raise SaploMockError("Corpus %s does not exist" % corpusId, ERROR_NOT_FOUND)
+                return corpus
+
+        def article(self, corpusId, articleId):
+                article = self.corpus(corpusId)['articles'].get(articleId)
+                if article is None:
+                        raise SaploMockError("Article %s does not exist in corpus %s" % (articleId, corpusId), ERROR_NOT_FOUND)
+                return article
+
+        def context(self, contextId):
+                context = self.contexts.get(contextId)
+                if context is None:
+                        raise SaploMockError("Context %s does not exist" % contextId, ERROR_NOT_FOUND)
+                return context
+
+
+def words(text):
+        return set(word.lower() for word in re.findall(r'\w+', text or '', re.UNICODE))
+
+
+def similarity(first, second):
+        if not first or not second:
+                return 0.0
+        return len(first & second) / float(len(first | second))
+
+
+def javaList(value):
+        """
+        Unwraps a json-rpc-java java.util.ArrayList
+        """
+        return value['list'] if isinstance(value, dict) else value
+
+
+class SaploMockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """
+        Answers JSON-RPC posts, single or batched, over HTTP/1.1 keep-alive connections
+        """
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+                #Like most servers, close connections that stay idle for longer than the keep-alive timeout
+                self.timeout = self.server.keepalive
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+        def do_POST(self):
+                server = self.server
+                body = self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+                encoding = (self.headers.getheader('Content-Encoding') or '').lower()
+                if encoding == 'gzip':
+                        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                elif encoding == 'deflate':
+                        body = zlib.decompress(body)
+                server.wait()
+                if server.httperrorrate and random.random() < server.httperrorrate:
+                        return self.reply(503, 'Service Unavailable')
+
+                token = urlparse.urlsplit(self.path).path.rpartition('jsessionid=')[2]
+                try:
+                        request = json.loads(body)
+                except ValueError:
+                        return self.reply(400, 'Bad Request')
+                if isinstance(request, list):
+                        if not server.batch:
+                                response = dict(id = None, error = dict(msg = "Batch requests are not supported", code = ERROR_INVALID_PARAMS))
+                        else:
+                                response = [self.call(token, call) for call in request]
+                else:
+                        response = self.call(token, request)
+                self.reply(200, json.dumps(response))
+
+        def call(self, token, request):
+                sapid = request.get('id')
+                if self.server.errorrate and random.random() < self.server.errorrate:
+                        return dict(id = sapid, error = dict(msg = "Injected error", code = ERROR_INJECTED))
+                try:
+                        return dict(id = sapid, result = self.server.api.call(token, request.get('method'), request.get('params') or []))
+                except SaploMockError, err:
+                        return dict(id = sapid, error = dict(msg = err.value, code = err.code))
+
+        def reply(self, status, body):
+                headers = "Content-Type: application/json\r\n"
+                if self.server.compression and len(body) >= 1024 and 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+                        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                        body = compressor.compress(body) + compressor.flush()
+                        headers += "Content-Encoding: gzip\r\n"
+                #Send the whole response at once, separate small writes interact badly with delayed ACKs
+                head = "%s %d %s\r\n%sContent-Length: %d\r\n\r\n" % (
+                                self.protocol_version, status, self.responses.get(status, ('',))[0], headers, len(body))
+                self.wfile.write(head + body)
+
+        def log_message(self, format, *args):
+                if self.server.verbose:
+                        BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SaploMockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        """
+        Threaded HTTP server running a SaploMockAPI.
+        """
+        daemon_threads      = True
+        allow_reuse_address = True
+        #Clients may open hundreds of connections at once, the default backlog of 5 drops them
+        request_queue_size  = 1024
+
+        def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, errorrate=0.0, httperrorrate=0.0,
+                        batch=True, api=None, verbose=False, compression=True, keepalive=None):
+                """
+                @type String
+                @param host - The interface to listen on
+                @type Number
+                @param port - The port to listen on, 0 picks a free port
+                @type Float
+                @param latency - Seconds every request is delayed
+                @type Float
+                @param jitter - Maximum random seconds added to the latency
+                @type Float
+                @param errorrate - Fraction of calls answered with a JSON-RPC error
+                @type Float
+                @param httperrorrate - Fraction of requests answered with HTTP 503
+                @type Bool
+                @param batch - Whether JSON-RPC batch requests are accepted
+                @type SaploMockAPI
+                @param api - The API state to serve, a new empty one is created if None
+                @type Bool
+                @param verbose - Whether to log every request to stderr
+                @type Bool
+                @param compression - Whether responses of 1 kB or more are gzipped for clients that accept it
+                @type Float
+                @param keepalive - Seconds an idle connection is kept open before the server closes it, None to keep it open
+                """
+                BaseHTTPServer.HTTPServer.__init__(self, (host, port), SaploMockHandler)
+                self.latency       = latency
+                self.jitter        = jitter
+                self.errorrate     = errorrate
+                self.httperrorrate = httperrorrate
+                self.batch         = batch
+                self.api           = api if api is not None else SaploMockAPI()
+                self.verbose       = verbose
+                self.compression   = compression
+                self.keepalive     = keepalive
+                self.url           = "http://%s:%d/rpc/json;jsessionid={token}" % self.server_address
+                self.thread        = None
+
+        def start(self):
+                """
+                Starts serving on a background thread
+                """
+                self.thread = threading.Thread(target=self.serve_forever)
+                self.thread.daemon = True
+                self.thread.start()
+                return self
+
+        def stop(self):
+                self.shutdown()
+                self.server_close()
+                if self.thread is not None:
+                        self.thread.join()
+
+        def server_bind(self):
+                BaseHTTPServer.HTTPServer.server_bind(self)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def wait(self):
+                delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                        time.sleep(delay)
+
+
+def main():
+        parser = argparse.ArgumentParser(description="Serves a local stand-in for the Saplo JSON-RPC API.")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8080)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds every request is delayed")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random seconds added to the latency")
+        parser.add_argument('--errorrate', type=float, default=0.0, help="Fraction of calls answered with an error")
+        parser.add_argument('--httperrorrate', type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+        parser.add_argument('--pendingpolls', type=int, default=0, help="Empty results before a wait = 0 job is done")
+        parser.add_argument('--sessionlifetime', type=float, help="Seconds before a session expires")
+        parser.add_argument('--keepalive', type=float, help="Seconds before an idle connection is closed")
+        parser.add_argument('--nobatch', action='store_true', help="Reject JSON-RPC batch requests")
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+        args = parser.parse_args()
+
+        api = SaploMockAPI(pendingpolls=args.pendingpolls, sessionlifetime=args.sessionlifetime)
+        server = SaploMockServer(args.host, args.port, args.latency, args.jitter, args.errorrate, args.httperrorrate,
+                        not args.nobatch, api, args.verbose, keepalive=args.keepalive)
+        print "Serving the Saplo mock API at", server.url
+        try:
+                server.serve_forever()
+        except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+        main()
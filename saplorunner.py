@@ -0,0 +1,207 @@
+"""
+Multi-process runner that shards tagging and similarity workloads across CPU cores.
+
+A single process spends much of its time encoding and decoding JSON under the GIL. The runner
+splits the work into shards (article id ranges of a corpus), hands them to a pool of worker
+processes that each create their own authenticated SaploJSONClient, and merges the records
+they produce into one output stream while reporting progress and throughput.
+
+Example of usage:
+        shards = articleRanges(1234, 1, 200000, 1000)
+        with open('tags.jsonl', 'w') as out:
+                run(tagArticles, shards, apikey, secretkey, processes=8, out=out)
+
+Or from the commandline:
+        python saplorunner.py --apikey KEY --secretkey SECRET --processes 8 tags 1234 --output tags.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from saploapi import SaploJSONClient, SaploSqliteCache, SaploError
+
+#The client of the current worker process, created when the process starts
+workerclient = None
+
+
+def articleRanges(corpusId, firstArticleId, lastArticleId, size):
+        """
+        Splits the article ids of a corpus into shards.
+
+        @rtype Array
+        @return (corpusId, firstArticleId, lastArticleId) tuples covering at most size articles each
+        """
+        return [(corpusId, first, min(first + size - 1, lastArticleId))
+                for first in xrange(firstArticleId, lastArticleId + 1, size)]
+
+
+def tagArticles(client, shard, workers=4, wait=30):
+        """
+        Task fetching the entity tags of every article in a shard.
+
+        @rtype Generator
+        @return Records with corpusId, articleId and either tags or error
+        """
+        corpusId, first, last = shard
+        args = ((corpusId, articleId, wait) for articleId in xrange(first, last + 1))
+        for (corpusId, articleId, wait), result in client.map('getEntityTags', args, workers=workers):
+                yield record(corpusId, articleId, 'tags', result)
+
+
+def similarArticles(client, shard, workers=4, wait=30, numberOfResults=50, minThreshold=0.0, maxThreshold=1.0):
+        """
+        Task fetching the similar articles of every article in a shard.
+
+        @rtype Generator
+        @return Records with corpusId, articleId and either similar or error
+        """
+        corpusId, first, last = shard
+        args = ((corpusId, articleId, wait, numberOfResults, minThreshold, maxThreshold)
+                for articleId in xrange(first, last + 1))
+        for args, result in client.map('getSimilarArticles', args, workers=workers):
+                yield record(corpusId, args[1], 'similar', result)
+
+
+def record(corpusId, articleId, name, result):
+        if isinstance(result, Exception):
+                return dict(corpusId = corpusId, articleId = articleId, error = errorMessage(result))
+        return {'corpusId': corpusId, 'articleId': articleId, name: result['result']}
+
+
+def errorMessage(err):
+        """
+        Gives the error of a record: the message of a SaploError, or the type and message of other exceptions,
+        i.e. an HTTPError or socket.timeout once the client has given up retrying
+        """
+        if isinstance(err, SaploError):
+                return err.value
+        return "%s: %s" % (type(err).__name__, err)
+
+
+def startWorker(apikey, secretkey, clientoptions, tokencache):
+        """
+        Creates the client of a worker process
+        """
+        global workerclient
+        if tokencache is not None:
+                clientoptions = dict(clientoptions, tokencache = SaploSqliteCache(tokencache))
+        workerclient = SaploJSONClient(apikey, secretkey, **clientoptions)
+
+
+def runShard(job):
+        """
+        Runs a task on one shard in a worker process. If the task fails, the records it produced are kept
+        and a record with the shard and the error is added, so one shard does not end the run.
+
+        @rtype Tuple
+        @return (shard, records, seconds)
+        """
+        task, options, shard = job
+        start = time.time()
+        records = []
+        try:
+                for item in task(workerclient, shard, **options):
+                        records.append(item)
+        except Exception, err:
+                records.append(dict(shard = shard, error = errorMessage(err)))
+        return shard, records, time.time() - start
+
+
+def reportProgress(progress):
+        sys.stderr.write("\r{shards}/{total} shards, {records} records, {errors} errors, {rate:.1f} records/s".format(**progress))
+        if progress['shards'] == progress['total']:
+                sys.stderr.write("\n")
+
+
+def run(task, shards, apikey, secretkey, processes=None, out=None, progress=reportProgress, clientoptions=None,
+        tokencache=None, **options):
+        """
+        Runs a task on every shard in a pool of worker processes.
+
+        @type Function
+        @param task - A module level function task(client, shard, **options) returning the shard's records. Records of
+                articles that could not be fetched, and of shards the task failed on, hold an error instead.
+        @type Array
+        @param shards - The shards to run the task on, i.e. from articleRanges
+        @type String
+        @param apikey - Saplo API key, every worker process creates its own session with it
+        @type String
+        @param secretkey - Saplo Secret key
+        @type Number
+        @param processes - Number of worker processes, one per CPU by default
+        @type File
+        @param out - Stream every record is written to as a JSON line, as soon as its shard completes
+        @type Function
+        @param progress - progress(dictionary) is called after every shard with shards, total, records, errors,
+                seconds and rate (records per second). None for no reporting.
+        @type Dictionary
+        @param clientoptions - Extra keyword arguments for the SaploJSONClient of each worker
+        @type String
+        @param tokencache - SaploSqliteCache file the workers share their session token through, so only one session is created
+        @rtype Dictionary
+        @return The final progress dictionary
+        """
+        shards = list(shards)
+        state = dict(shards = 0, total = len(shards), records = 0, errors = 0, seconds = 0.0, rate = 0.0)
+        start = time.time()
+        pool = multiprocessing.Pool(processes, startWorker, (apikey, secretkey, clientoptions or {}, tokencache))
+        try:
+                for shard, records, seconds in pool.imap_unordered(runShard, [(task, options, shard) for shard in shards]):
+                        for item in records:
+                                if out is not None:
+                                        out.write(json.dumps(item) + "\n")
+                                state['errors'] += 1 if 'error' in item else 0
+                        state['shards']  += 1
+                        state['records'] += len(records)
+                        state['seconds']  = time.time() - start
+                        state['rate']     = state['records'] / state['seconds'] if state['seconds'] else 0.0
+                        if progress is not None:
+                                progress(dict(state))
+                pool.close()
+        except:
+                pool.terminate()
+                raise
+        finally:
+                pool.join()
+        return state
+
+
+TASKS = dict(tags = tagArticles, similar = similarArticles)
+
+
+def main():
+        parser = argparse.ArgumentParser(description="Fetches tags or similar articles for a corpus with several processes.")
+        parser.add_argument('task', choices=sorted(TASKS))
+        parser.add_argument('corpusId', type=int)
+        parser.add_argument('--apikey', required=True)
+        parser.add_argument('--secretkey', required=True)
+        parser.add_argument('--processes', type=int, help="Worker processes, one per CPU by default")
+        parser.add_argument('--workers', type=int, default=4, help="Concurrent requests per process")
+        parser.add_argument('--shardsize', type=int, default=1000, help="Articles per shard")
+        parser.add_argument('--first', type=int, default=1, help="First article id")
+        parser.add_argument('--last', type=int, help="Last article id, the corpus' lastArticleId by default")
+        parser.add_argument('--wait', type=int, default=30, help="Seconds the server may spend per article")
+        parser.add_argument('--output', help="File to write the JSON line records to (default stdout)")
+        parser.add_argument('--tokencache', help="File to share the session token in between the processes and runs")
+        args = parser.parse_args()
+
+        try:
+                last = args.last
+                if last is None:
+                        tokencache = SaploSqliteCache(args.tokencache) if args.tokencache else None
+                        client = SaploJSONClient(args.apikey, args.secretkey, tokencache = tokencache)
+                        last = client.getCorpusInfo(args.corpusId)['result']['lastArticleId']
+                shards = articleRanges(args.corpusId, args.first, last, args.shardsize)
+                out = open(args.output, 'w') if args.output else sys.stdout
+                run(TASKS[args.task], shards, args.apikey, args.secretkey, args.processes, out,
+                    tokencache = args.tokencache, workers = args.workers, wait = args.wait)
+        except SaploError, err:
+                print >> sys.stderr, err.__str__()
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the incremental JSON-RPC response decoder, and for the client against the mock server in saplomock.
+
+Run with:
+        python -m unittest test_saploapi
+"""
+
+import json
+import random
+import socket
+import time
+import unittest
+import urllib2
+
+from saploapi import SaploStreamDecoder, SaploError, SaploJSONClient, SaploMemoryCache
+from saplomock import SaploMockServer
+
+RESPONSE = {
+        'id': 7,
+        'result': [
+                {'tagId': 1, 'tagWord': u'Malmö', 'tagTypeId': 5},
+                {'tagId': 22, 'tagWord': u'Zoë "Z" Saldaña\\', 'tagTypeId': 3},
+                {'tagId': 333, 'tagWord': u'東京', 'tagTypeId': 5, 'score': -12.5e-3},
+                {'tagId': 4444, 'tagWord': u'𝄞 clef', 'tagTypeId': 4, 'extra': [None, True, False, {}]},
+                12345678,
+                -0.25,
+                None,
+                u'plain € string',
+                ],
+        'extra': {'nested': [1, 2, {'a': u'å'}]},
+        }
+
+
+def chunked(data, boundaries):
+        """
+        Splits data at the given offsets
+        """
+        offsets = [0] + sorted(boundaries) + [len(data)]
+        return [data[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+class SaploStreamDecoderTest(unittest.TestCase):
+        def setUp(self):
+                self.encoded = json.dumps(RESPONSE, ensure_ascii=False).encode('utf-8')
+
+        def decode(self, chunks, streamedkey='result'):
+                decoder = SaploStreamDecoder(streamedkey)
+                items = []
+                for chunk in chunks:
+                        items.extend(decoder.feed(chunk))
+                decoder.close()
+                return items, decoder
+
+        def assertDecoded(self, chunks):
+                items, decoder = self.decode(chunks)
+                self.assertEqual(items, RESPONSE['result'])
+                self.assertEqual(decoder.count, len(RESPONSE['result']))
+                self.assertEqual(decoder.response['id'], RESPONSE['id'])
+                self.assertEqual(decoder.response['extra'], RESPONSE['extra'])
+
+        def testWhole(self):
+                self.assertDecoded([self.encoded])
+
+        def testEveryByte(self):
+                self.assertDecoded([self.encoded[index:index + 1] for index in range(len(self.encoded))])
+
+        def testEverySplitPoint(self):
+                for index in range(len(self.encoded) + 1):
+                        self.assertDecoded(chunked(self.encoded, [index]))
+
+        def testInsideStrings(self):
+                for text in (u'Zoë "Z" Saldaña\\', u'plain € string'):
+                        start = self.encoded.index(json.dumps(text, ensure_ascii=False).encode('utf-8'))
+                        for offset in range(1, len(text.encode('utf-8')) + 2):
+                                self.assertDecoded(chunked(self.encoded, [start + offset]))
+
+        def testInsideNumbers(self):
+                for number in ('12345678', '-0.0125', '-0.25', '4444'):
+                        start = self.encoded.index(number)
+                        for offset in range(1, len(number)):
+                                self.assertDecoded(chunked(self.encoded, [start + offset]))
+
+        def testInsideMultibyteCharacters(self):
+                for char in (u'ö', u'€', u'東', u'𝄞'):
+                        start = self.encoded.index(char.encode('utf-8'))
+                        for offset in range(1, len(char.encode('utf-8'))):
+                                self.assertDecoded(chunked(self.encoded, [start + offset]))
+
+        def testRandomBoundaries(self):
+                generator = random.Random(1234)
+                for attempt in range(200):
+                        boundaries = generator.sample(range(1, len(self.encoded)), generator.randint(1, 20))
+                        self.assertDecoded(chunked(self.encoded, boundaries))
+
+        def testNumberAtEndOfChunkWaitsForDelimiter(self):
+                decoder = SaploStreamDecoder()
+                self.assertEqual(decoder.feed('{"result": [12'), [])
+                self.assertEqual(decoder.feed('34, 5'), [1234])
+                self.assertEqual(decoder.feed(']}'), [5])
+                decoder.close()
+
+        def testNullValues(self):
+                items, decoder = self.decode(chunked('{"id": null, "result": [null, 1], "error": null}', [12, 24]))
+                self.assertEqual(items, [None, 1])
+                self.assertEqual(decoder.response, {'id': None, 'result': [], 'error': None})
+
+        def testErrorResponse(self):
+                items, decoder = self.decode(chunked('{"id": 0, "error": {"code": 595, "msg": "Invalid session"}}', [20, 40]))
+                self.assertEqual(items, [])
+                self.assertEqual(decoder.response['error'], {'code': 595, 'msg': 'Invalid session'})
+
+        def testResultNotList(self):
+                items, decoder = self.decode(['{"result": {"corpusId"', ': 3}}'])
+                self.assertEqual(items, [])
+                self.assertEqual(decoder.response['result'], {'corpusId': 3})
+
+        def testIncomplete(self):
+                decoder = SaploStreamDecoder()
+                decoder.feed(self.encoded[:-1])
+                self.assertRaises(SaploError, decoder.close)
+
+        def testMalformed(self):
+                decoder = SaploStreamDecoder()
+                self.assertRaises(SaploError, decoder.feed, '["result"]')
+
+
+class SaploJSONClientTest(unittest.TestCase):
+        def setUp(self):
+                self.server = SaploMockServer()
+                self.server.start()
+                self.patched = dict(url = SaploJSONClient.url, backoff = SaploJSONClient.backoff)
+                SaploJSONClient.url     = self.server.url
+                SaploJSONClient.backoff = 0.0
+                self.sent = []
+
+        def tearDown(self):
+                for name, value in self.patched.items():
+                        setattr(SaploJSONClient, name, value)
+                self.server.stop()
+
+        def client(self, **options):
+                """
+                Creates a client that records the method of every request it sends in self.sent
+                """
+                client = SaploJSONClient('apikey', 'secretkey', **options)
+                client.addRequestHook(pre=lambda meth, body: self.sent.append(meth))
+                return client
+
+        def testRenewsExpiredSession(self):
+                client = self.client()
+                corpusId = client.createCorpus('corpus', 'description', 'en')['result']['corpusId']
+                token = client.token
+                self.server.api.expireSessions()
+                self.assertEqual(client.getCorpusInfo(corpusId)['result']['corpusId'], corpusId)
+                self.assertNotEqual(client.token, token)
+                self.assertEqual(self.sent.count('auth.createSession'), 2)
+
+        def testRenewsSessionOnlyOnce(self):
+                self.server.api.sessionlifetime = -1
+                client = self.client()
+                try:
+                        client.createCorpus('corpus', 'description', 'en')
+                        self.fail("The session never stays valid")
+                except SaploError, err:
+                        self.assertTrue(client.isSessionError(err))
+                self.assertEqual(self.sent.count('auth.createSession'), 2)
+                self.assertEqual(self.sent.count('corpus.createCorpus'), 2)
+
+        def testRetriesIdempotentCalls(self):
+                client = self.client(retries=2)
+                corpusId = client.createCorpus('corpus', 'description', 'en')['result']['corpusId']
+                self.server.httperrorrate = 1.0
+                self.assertRaises(urllib2.HTTPError, client.getCorpusInfo, corpusId)
+                self.assertEqual(self.sent.count('corpus.getInfo'), 3)
+
+        def testDoesNotRetryOtherCalls(self):
+                client = self.client(retries=2)
+                client.getCorpusPermission()
+                self.server.httperrorrate = 1.0
+                self.assertRaises(urllib2.HTTPError, client.createCorpus, 'corpus', 'description', 'en')
+                self.assertEqual(self.sent.count('corpus.createCorpus'), 1)
+                self.assertEqual(self.server.api.corpora, {})
+
+        def testDeadline(self):
+                client = self.client(deadline=0.3)
+                client.getCorpusPermission()
+                self.server.latency = 2.0
+                start = time.time()
+                self.assertRaises(socket.error, client.getCorpusPermission)
+                self.assertLess(time.time() - start, 1.0)
+
+        def testBatch(self):
+                client = self.client()
+                corpusId = client.createCorpus('corpus', 'description', 'en')['result']['corpusId']
+                batch = client.batch()
+                batch.call('corpus.getInfo', (corpusId,))
+                batch.call('corpus.getInfo', (corpusId + 1,))
+                info, missing = batch.execute()
+                self.assertEqual(info['result']['corpusId'], corpusId)
+                self.assertTrue(isinstance(missing, SaploError))
+                self.assertTrue(client.batchsupported)
+                self.assertEqual(self.sent.count('corpus.getInfo'), 0)
+
+        def testBatchFallsBackToPipelining(self):
+                self.server.batch = False
+                client = self.client()
+                corpusId = client.createCorpus('corpus', 'description', 'en')['result']['corpusId']
+                for attempt in range(2):
+                        batch = client.batch()
+                        batch.call('corpus.getInfo', (corpusId,))
+                        batch.call('corpus.getInfo', (corpusId + 1,))
+                        info, missing = batch.execute()
+                        self.assertEqual(info['result']['corpusId'], corpusId)
+                        self.assertTrue(isinstance(missing, SaploError))
+                self.assertFalse(client.batchsupported)
+                #Only the first batch is tried before the calls are sent one by one
+                self.assertEqual(self.sent.count('batch'), 1)
+                self.assertEqual(self.sent.count('corpus.getInfo'), 4)
+
+        def testCacheInvalidation(self):
+                client = self.client(cache=SaploMemoryCache())
+                corpusId = client.createCorpus('corpus', 'description', 'en')['result']['corpusId']
+                self.assertEqual(client.getCorpusInfo(corpusId)['result']['lastArticleId'], 0)
+                self.assertEqual(client.getCorpusInfo(corpusId)['result']['lastArticleId'], 0)
+                self.assertEqual(self.sent.count('corpus.getInfo'), 1)
+                client.addArticle(corpusId, 'headline', '', 'body', '', 'http://example.com/1', '', 'en')
+                self.assertEqual(client.getCorpusInfo(corpusId)['result']['lastArticleId'], 1)
+                self.assertEqual(self.sent.count('corpus.getInfo'), 2)
+
+        def testCacheKeptApartPerApiKey(self):
+                cache = SaploMemoryCache()
+                client = self.client(cache=cache)
+                other  = SaploJSONClient('otherkey', 'secretkey', cache=cache)
+                other.addRequestHook(pre=lambda meth, body: self.sent.append(meth))
+                client.getCorpusPermission()
+                other.getCorpusPermission()
+                self.assertEqual(self.sent.count('corpus.getPermissions'), 2)
+
+        def testReconnectsClosedIdleConnection(self):
+                self.server.stop()
+                self.server = SaploMockServer(keepalive=0.1)
+                self.server.start()
+                SaploJSONClient.url = self.server.url
+                client = self.client(retries=0)
+                client.getCorpusPermission()
+                time.sleep(0.3)
+                self.assertEqual(client.getCorpusPermission()['result'], [])
+
+
+if __name__ == '__main__':
+        unittest.main()